@@ -0,0 +1,344 @@
+"""
+Timing benchmarks for calculators & database loading
+
+"""
+from __future__ import print_function
+
+import mobile_companion.core as MC
+import mobile_companion.database as MDB
+import mobile_companion.calculators as MCC
+import mobile_companion.team_optimizer.util as TOU
+import mobile_companion.team_optimizer.genetic as TOG
+import mobile_companion.team_optimizer.anneal as TOA
+import mobile_companion.team_optimizer.vector_genetic as TOV
+import mobile_companion.objectives as MO
+import numpy as np
+import random, time, copy, sys, types
+
+
+def _time_per_call(func, args):
+    """
+    Average time (in microseconds) of calling func once for each of args
+
+    """
+    start = time.time()
+    for arg in args:
+        func(arg)
+
+    return (time.time() - start) / len(args) * 1e6
+
+
+def _random_teams(player_db, num_teams, seed=0):
+    random.seed(seed)
+    preprocessed_player_db = TOU.pre_process_database(player_db)
+
+    return [ TOG.create_individual(preprocessed_player_db) for i in range(num_teams) ]
+
+
+def bench_import(database_file='../player_database.csv'):
+    """
+    Time of importing database as list of players vs columns (and creating
+    players from columns)
+
+    """
+    start = time.time()
+    player_db = MDB.import_database_csv(database_file)
+    rows_time = time.time() - start
+
+    start = time.time()
+    player_columns = MDB.import_database_csv(database_file, columnar=True)
+    columns_time = time.time() - start
+
+    start = time.time()
+    player_columns.players()
+    players_time = time.time() - start
+
+    print("import: {:.2f}s players, {:.2f}s columns [ {:.1f}x ], {:.2f}s creating all players "
+          "from columns ({} players)".format(rows_time, columns_time, rows_time / columns_time, players_time,
+                                             len(player_db)))
+
+
+def bench_import_files(database_files, processes=None):
+    """
+    Time of importing & merging several database files serially vs in a process pool
+
+    """
+    start = time.time()
+    MDB.import_database_files(database_files, columnar=True, processes=1)
+    serial_time = time.time() - start
+
+    start = time.time()
+    MDB.import_database_files(database_files, columnar=True, processes=processes)
+    pool_time = time.time() - start
+
+    print("import {} files: {:.2f}s serial, {:.2f}s pool [ {:.1f}x ]".format(len(database_files), serial_time,
+                                                                          pool_time, serial_time / pool_time))
+
+
+def bench_iter_database(database_file='../player_database.csv', positions=('QB',)):
+    """
+    Time of importing whole database then filtering vs iterating with the filter
+    pushed down
+
+    """
+    auction_filter = MC.AuctionFilter(positions=list(positions))
+
+    start = time.time()
+    players = auction_filter.filter(MDB.import_database_csv(database_file))
+    import_time = time.time() - start
+
+    start = time.time()
+    iter_players = list(MDB.iter_database_csv(database_file, auction_filter))
+    iter_time = time.time() - start
+
+    if players != iter_players:
+        raise ValueError("iter_database_csv does not match filtered import")
+
+    print("filtered import: {:.2f}s import & filter, {:.2f}s iter [ {:.1f}x ] "
+          "({} players)".format(import_time, iter_time, import_time / iter_time, len(players)))
+
+
+def _deep_size(*objs):
+    """
+    Total sys.getsizeof (in bytes) of objs and everything they reference, each
+    object counted once (numpy arrays include their data, or the array they view)
+
+    """
+    seen = set()
+    stack = list(objs)
+    size = 0
+
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _unsized_types):
+            continue
+
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, np.ndarray):
+            if obj.base is not None:
+                stack.append(obj.base)
+            if obj.dtype == object:
+                stack.extend(obj.ravel().tolist())
+            continue
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+
+        for cls in type(obj).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            for slot in ([ slots ] if isinstance(slots, str) else slots):
+                if slot not in ('__dict__', '__weakref__') and hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+
+    return size
+
+# shared by everything, so not part of any object's size
+_unsized_types = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def bench_player_memory(database_file='../player_database.csv'):
+    """
+    Memory of all players from import_database_csv vs compact players from
+    PlayerColumns (including the columns themselves), as the size of all the
+    objects each keeps (see _deep_size)
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    compact_db = MDB.import_database_csv(database_file, columnar=True).players()
+
+    if player_db != compact_db:
+        raise ValueError("Compact players do not match imported players")
+
+    rows_memory = _deep_size(player_db)
+    compact_memory = _deep_size(compact_db)
+    print("player memory: {:.0f} bytes per player imported, {:.0f} bytes compact "
+          "[ {:.1f}x ]".format(float(rows_memory) / len(player_db), float(compact_memory) / len(player_db),
+                               float(rows_memory) / compact_memory))
+
+
+def bench_calculate(weight_file='../standard_weights.dat', database_file='../player_database.csv',
+                    num_teams=500):
+    """
+    Per team time of Standard.calculate (uncompiled vs compiled), Standard.score and
+    Standard.calculate_many
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    teams = _random_teams(player_db, num_teams)
+
+    calc = MCC.Standard(weight_file)
+    compiled_calc = MCC.Standard(weight_file, compiled=True)
+
+    for team in teams:
+        if calc.calculate(team) != compiled_calc.calculate(team):
+            raise ValueError("Compiled calculator does not match for: {}".format(team.roster))
+
+    uncompiled_time = _time_per_call(calc.calculate, teams)
+    compiled_time = _time_per_call(compiled_calc.calculate, teams)
+
+    print("calculate: {:.0f}us uncompiled, {:.0f}us compiled "
+          "[ {:.1f}x ]".format(uncompiled_time, compiled_time, uncompiled_time / compiled_time))
+
+    score_time = _time_per_call(compiled_calc.score, teams)
+
+    print("score: {:.0f}us [ {:.1f}x ]".format(score_time, uncompiled_time / score_time))
+
+    batch_time = _time_per_call(compiled_calc.calculate_many, [ teams ]) / len(teams)
+
+    print("calculate_many: {:.0f}us per team "
+          "[ {:.1f}x ]".format(batch_time, uncompiled_time / batch_time))
+
+
+def bench_position_cache(weight_file='../standard_weights.dat', database_file='../player_database.csv',
+                         num_steps=1000):
+    """
+    Per call time of Standard.score with & without position cache, over a chain
+    of rosters that differ by random (anneal) steps
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    preprocessed_player_db = TOU.pre_process_database(player_db)
+
+    teams = _random_teams(player_db, 1)
+    for i in range(num_steps):
+        teams.append(TOA._random_step(teams[-1], preprocessed_player_db))
+
+    calc = MCC.Standard(weight_file)
+    cached_calc = MCC.Standard(weight_file, position_cache_size=100000)
+
+    uncached_time = _time_per_call(calc.score, teams)
+    cached_time = _time_per_call(cached_calc.score, teams)
+
+    print("score: {:.0f}us uncached, {:.0f}us cached "
+          "[ {:.1f}x ]".format(uncached_time, cached_time, uncached_time / cached_time))
+    print(cached_calc.position_cache)
+
+
+def bench_marginal_gains(weight_file='../standard_weights.dat', database_file='../player_database.csv',
+                         obj_type='overall'):
+    """
+    Time of Standard.marginal_gains vs scoring every swap with Standard.calculate
+    (extrapolated from the first roster position)
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    team = _random_teams(player_db, 1)[0]
+
+    calc = MCC.Standard(weight_file, compiled=True)
+    score_func = lambda scores: scores[obj_type]['rounded']
+
+    start = time.time()
+    gains = calc.marginal_gains(team, player_db, score_func)
+    gains_time = time.time() - start
+
+    num_swaps = sum(len(swap_players) for swap_players, swap_gains in gains.values())
+    roster_position, (swap_players, swap_gains) = next(iter(gains.items()))
+
+    def calculate_swap(player):
+        swap_team = copy.deepcopy(team)
+        swap_team.set_position(roster_position, player)
+        return calc.calculate(swap_team)
+
+    calculate_time = _time_per_call(calculate_swap, swap_players) * num_swaps / 1e6
+
+    print("marginal_gains: {:.2f}s for {} swaps, {:.1f}s calculating each "
+          "[ {:.1f}x ]".format(gains_time, num_swaps, calculate_time, calculate_time / gains_time))
+
+
+def bench_multi_standard(weight_files, database_file='../player_database.csv', num_teams=500):
+    """
+    Per team time of scoring under several weight files with MultiStandard vs a
+    compiled Standard for each weight file
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    teams = _random_teams(player_db, num_teams)
+
+    calcs = [ MCC.Standard(weight_file, compiled=True) for weight_file in weight_files ]
+    multi_calc = MCC.MultiStandard(weight_files)
+
+    separate_time = _time_per_call(lambda team: [ calc.score(team) for calc in calcs ], teams)
+    multi_time = _time_per_call(multi_calc.score, teams)
+
+    print("score x {}: {:.0f}us separately, {:.0f}us multi "
+          "[ {:.1f}x ]".format(len(weight_files), separate_time, multi_time, separate_time / multi_time))
+
+    separate_time = _time_per_call(lambda teams: [ calc.calculate_many(teams) for calc in calcs ], [ teams ])
+    multi_time = _time_per_call(multi_calc.calculate_many, [ teams ])
+
+    print("calculate_many x {}: {:.0f}us separately, {:.0f}us multi per team "
+          "[ {:.1f}x ]".format(len(weight_files), separate_time / len(teams), multi_time / len(teams),
+                               separate_time / multi_time))
+
+
+def bench_vector_genetic(weight_file='../standard_weights.dat', database_file='../player_database.csv',
+                         population_size=2000, num_evolutions=50):
+    """
+    Time & best objective of genetic.optimize (population 50, 1000 evolutions) vs
+    vector_genetic.optimize with a much larger population, on the same candidates
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    calc = MCC.Standard(weight_file, compiled=True)
+    obj_func = MO.Objective(calc, "overall rounded")
+    players = TOU.candidate_pools(player_db, calculator=calc)
+
+    random.seed(0)
+    start = time.time()
+    genetic_team, res = TOG.optimize(50, players, obj_func, num_evolutions=1000)
+    genetic_time = time.time() - start
+
+    start = time.time()
+    vector_team, res = TOV.optimize(population_size, players, obj_func, num_evolutions=num_evolutions, seed=0)
+    vector_time = time.time() - start
+
+    print("genetic: {:.1f}s population 50 (objective {:.2f}), {:.1f}s population {} "
+          "(objective {:.2f})".format(genetic_time, obj_func(genetic_team), vector_time, population_size,
+                                     obj_func(vector_team)))
+
+
+def bench_genetic_workers(workers, weight_file='../standard_weights.dat', database_file='../player_database.csv',
+                          population_size=500, num_evolutions=20):
+    """
+    Generations per second of genetic.optimize scoring in this process vs a pool of
+    workers (results must be the same)
+
+    """
+    player_db = MDB.import_database_csv(database_file)
+    calc = MCC.Standard(weight_file, compiled=True)
+    obj_func = MO.Objective(calc, "overall rounded")
+    players = TOU.candidate_pools(player_db, calculator=calc)
+
+    start = time.time()
+    serial_team, res = TOG.optimize(population_size, players, obj_func, num_evolutions=num_evolutions, seed=0)
+    serial_time = time.time() - start
+
+    start = time.time()
+    pool_team, res = TOG.optimize(population_size, players, obj_func, num_evolutions=num_evolutions, seed=0,
+                                  workers=workers)
+    pool_time = time.time() - start
+
+    if pool_team.key != serial_team.key:
+        raise ValueError("Results with {} workers do not match".format(workers))
+
+    print("genetic generations: {:.1f}/s serial, {:.1f}/s {} workers "
+          "[ {:.1f}x ]".format(num_evolutions / serial_time, num_evolutions / pool_time, workers,
+                               serial_time / pool_time))
+
+
+if __name__ == '__main__':
+    bench_import()
+    bench_iter_database()
+    bench_player_memory()
+    bench_calculate()
+    bench_position_cache()
+    bench_marginal_gains()
+    bench_vector_genetic()
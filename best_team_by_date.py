@@ -1,22 +1,43 @@
 import mobile_companion.database as MDB
 import mobile_companion.team as MT
 import mobile_companion.calculators as MCC
+import mobile_companion.objectives as MCO
 import mobile_companion.team_optimizer.meta as META
+import mobile_companion.team_optimizer.util as TOU
 import copy, pickle
 from datetime import timedelta
 
 
 
-def calc_best_teams(obj_type='overall'):
+def calc_best_teams(obj_type='overall', incremental=False):
+    """
+    Best team each week, using cards added up to then
+
+    incremental:    if True, only the first week is fully optimized and later weeks
+                    update the prior best team for just the newly added cards (see
+                    meta.reoptimize), with one objective cache kept for all weeks and
+                    the new cards added to the prior week's candidate pools (see
+                    util.add_candidates)
+
+    """
     outfile = 'best_{}.dat'.format(obj_type)
     
     res = dict()
-    calc = MCC.Standard('../standard_weights.dat')
+    calc = MCC.Standard('../standard_weights.dat', compiled=True, position_cache_size=200000)
+
+    # batch & incremental evaluation come with the objective
+    obj_func = MCO.Objective(calc, [ (obj_type, 'rounded', 1.0) ])
 
-    obj_func = lambda x: calc.calculate(x)[1][obj_type]['rounded']
+    if incremental:
+        # a roster's objective doesn't change from week to week
+        obj_func = TOU.CachedObjective(obj_func, maxsize=1000000)
+        cache_size = None
+    else:
+        cache_size = 100000
 
-    player_db = MDB.import_database_csv('../player_database.csv')
-    dates = sorted(set([p.date_added for p in player_db]))
+    # binary snapshot of the database is rebuilt only when the CSV changes
+    player_db = MDB.PlayerDatabase(MDB.load_database('../player_database.csv'))
+    dates = player_db.dates_added()
 
     start_date = dates[0]
     end_date = dates[-1]
@@ -24,17 +45,39 @@ def calc_best_teams(obj_type='overall'):
     print("Running analysis on dates {} to {}".format(start_date, end_date))
 
     current_date = start_date
+    prior_date = None
     prior_best_team = None
 
     while current_date <= end_date:
-        current_players = [ p for p in player_db if p.date_added <= current_date ]
-        print("Starting {} [ {} players ]".format(current_date, len(current_players)))
+        if incremental and prior_best_team is not None:
+            new_players = player_db.query(max_date_added=current_date,
+                                          predicate=lambda p: p.date_added > prior_date)
+            print("Updating {} [ {} new players ]".format(current_date, len(new_players)))
+
+            if len(new_players) == 0:
+                best_team, best_obj = prior_best_team, res[prior_date][1]
+            else:
+                # last week's pools with just the new cards added (when that's safe)
+                candidates = TOU.add_candidates(candidates, player_db.query(max_date_added=current_date),
+                                                new_players)
+
+                best_team, best_obj, roster_positions = META.reoptimize(prior_best_team, candidates, new_players,
+                                                                        obj_func, verbose=True)
+        else:
+            current_players = MDB.PlayerDatabase(player_db.query(max_date_added=current_date))
+            print("Starting {} [ {} players ]".format(current_date, len(current_players)))
+
+            candidates = TOU.candidate_pools(current_players, calculator=calc)
 
-        best_team, best_obj = META.optimize(current_players, obj_func, initial_guess=prior_best_team)
+            # no upper_bounds screening: it saves little or nothing on the myopic &
+            # anneal swaps here, and turns off myopic's batch scoring of swaps
+            best_team, best_obj = META.optimize(candidates, obj_func, initial_guess=prior_best_team,
+                                               cache_size=cache_size)
 
         res[current_date] = (best_team, best_obj)
         pickle.dump(res, open(outfile, 'wb'))
 
+        prior_date = current_date
         current_date = current_date + timedelta(days=7)
         prior_best_team = best_team
         print("Best obj: {}".format(best_obj))
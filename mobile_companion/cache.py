@@ -0,0 +1,121 @@
+"""
+Caches for (expensive) calculator & optimizer results
+
+"""
+
+
+class LRUCache(object):
+    """
+    Size bounded cache that evicts least recently used entries
+
+    Entries are evicted in batches (down to *evict_to* of maxsize) once the cache
+    grows past maxsize, which keeps lookups to plain dict operations.  Counts
+    cache hits and misses.
+
+    """
+
+    def __init__(self, maxsize=100000, evict_to=.9):
+        self.maxsize = maxsize
+        self.evict_to = evict_to
+
+        self.hits = 0
+        self.misses = 0
+
+        self._data = dict()
+        self._last_used = dict()
+        self._clock = 0
+
+    def get(self, key, default=None):
+        """
+        Cached value for key (or default if key isn't cached)
+
+        """
+        value = self._data.get(key, default)
+
+        if value is default and key not in self._data:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._clock += 1
+            self._last_used[key] = self._clock
+
+        return value
+
+    def get_many(self, keys):
+        """
+        Cached values for list of keys (None for any key that isn't cached)
+
+        """
+        data = self._data
+        values = [ data.get(key) for key in keys ]
+
+        found = [ key for key, value in zip(keys, values) if value is not None ]
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+
+        self._clock += 1
+        self._last_used.update(dict.fromkeys(found, self._clock))
+
+        return values
+
+    def set(self, key, value):
+        """
+        Cache value for key, evicting least recently used entries if needed
+
+        """
+        self._clock += 1
+        self._data[key] = value
+        self._last_used[key] = self._clock
+
+        if len(self._data) > self.maxsize:
+            self._evict()
+
+    def discard(self, keys):
+        """
+        Remove any of keys that are cached
+
+        """
+        for key in keys:
+            self._data.pop(key, None)
+            self._last_used.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._last_used.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+
+        return float(self.hits) / lookups
+
+    def items(self):
+        """
+        List of (key, value) of all entries (not counted as uses)
+
+        """
+        return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._data.keys()))
+
+    def __repr__(self):
+        return ("{}(size={}, maxsize={}, hits={}, misses={}, "
+                "hit rate={:.1%})".format(self.__class__.__name__, len(self), self.maxsize,
+                                          self.hits, self.misses, self.hit_rate))
+
+    def _evict(self):
+        num_to_keep = int(self.maxsize * self.evict_to)
+        by_last_use = sorted(self._last_used, key=self._last_used.get)
+
+        for key in by_last_use[:len(by_last_use) - num_to_keep]:
+            del self._data[key]
+            del self._last_used[key]
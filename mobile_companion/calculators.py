@@ -3,15 +3,46 @@ Calculators for various team & player overall metrics
 
 """
 
-import os, csv, six
-from collections import defaultdict
+import os, csv, six, operator, copy
+import numpy as np
+from collections import defaultdict, namedtuple
+from .team import (Team, _allowable_player_positions, _team_positions_offense, _team_positions_defense,
+                   _team_positions_special, _team_position_index)
+from .cache import LRUCache
+
+# sub rosters in the order team scores are accumulated
+_sub_roster_names = [ 'offense', 'defense', 'special' ]
+
+# most recently compiled players each calculator keeps
+_compiled_players_cache_size = 100000
+
+# player data converted to arrays for compiled calculations
+_CompiledPlayer = namedtuple("_CompiledPlayer", [ 'position', 'team', 'attributes', 'boosts' ])
+
+# list of players compiled to arrays (one entry per player, boost tables have one
+# row per boost with each player's boosts in order from boost_start)
+_CompiledPlayers = namedtuple("_CompiledPlayers", [ 'positions', 'teams', 'attributes', 'boost_start',
+                                                    'boost_count', 'boost_teams', 'boost_attributes',
+                                                    'boost_values' ])
 
 class Standard(object):
     """
     Standard overall rating
+
+    compiled:   if True, calculate using position x attribute weight matrix and
+                per-player attribute arrays instead of walking nested dicts.  Results
+                are identical to the uncompiled calculation.
+
+    position_cache_size:    if not None, score() caches each player's position score
+                keyed by the boosts that apply to them, keeping at most this many
+                entries (see position_cache for hit/miss counts)
+
+    Compiled players (and any cached position scores) keep their players, for up
+    to _compiled_players_cache_size recently scored players.  invalidate() drops
+    those of changed cards sooner, eg between databases.
     """
 
-    def __init__(self, weight_file=None):
+    def __init__(self, weight_file=None, compiled=False, position_cache_size=None):
         if weight_file is None:
             weight_file = 'standard_weights.dat'
 
@@ -32,8 +63,19 @@ class Standard(object):
         self.low = low
         self.total = total
 
+        self.compiled = compiled
+        self._compile_weights()
+
+        if position_cache_size is not None:
+            self.position_cache = LRUCache(maxsize=position_cache_size)
+        else:
+            self.position_cache = None
+
 
     def calculate(self, team):
+        if self.compiled:
+            return self._calculate_compiled(team)
+
         # gather boosts first
         boosts = []
         for player in team.roster.values():
@@ -133,6 +175,448 @@ class Standard(object):
 
         return player_attributes, team_attributes
 
+    def _compile_weights(self):
+        """
+        Convert weights into arrays indexed by player position & attribute
+
+        Each position keeps its attributes in the same order as its weights dict so
+        weighted sums are accumulated in exactly the same order as calculate()
+
+        """
+        positions = sorted(self.weights.keys())
+
+        attributes = []
+        for player_position in positions:
+            for attribute in self.weights[player_position].keys():
+                if attribute not in attributes:
+                    attributes.append(attribute)
+
+        attribute_index = { attribute: i for i, attribute in enumerate(attributes) }
+        num_weights = max(len(self.weights[p]) for p in positions)
+
+        # weights are padded with zeros, which don't change the (sequential) sums
+        weight_order = np.zeros((len(positions), num_weights), dtype=int)
+        weight_values = np.zeros((len(positions), num_weights))
+        weight_matrix = np.zeros((len(positions), len(attributes)))
+        position_attributes = []
+        position_columns = []
+
+        for iposition, player_position in enumerate(positions):
+            position_weights = self.weights[player_position]
+            for iweight, (attribute, weight) in enumerate(six.iteritems(position_weights)):
+                weight_order[iposition, iweight] = attribute_index[attribute]
+                weight_values[iposition, iweight] = weight
+                weight_matrix[iposition, attribute_index[attribute]] = weight
+
+            position_attributes.append(list(position_weights.keys()))
+            position_columns.append(operator.itemgetter(*[ attribute_index[a] for a in position_weights.keys() ]))
+
+        self._positions = positions
+        self._position_index = { p: i for i, p in enumerate(positions) }
+        self._position_attributes = position_attributes
+        self._position_columns = position_columns
+        self._attributes = attributes
+        self._attribute_index = attribute_index
+        self._weight_order = weight_order
+        self._weight_values = weight_values
+        self._weight_matrix = weight_matrix
+        self._total = np.array([ self.total[p] for p in positions ])
+        self._low = np.array([ self.low[p] for p in positions ])
+        self._scaler = np.array([ 100.0 / (self.high[p] - self.low[p]) for p in positions ])
+
+        # roster positions in the same order calculate() walks each sub roster
+        sub_roster_positions = [
+            list({ pos: None for pos in _team_positions_offense }.keys()),
+            list({ pos: None for pos in _team_positions_defense }.keys()),
+            list({ pos: None for pos in _team_positions_special }.keys()) ]
+
+        self._roster_positions = sum(sub_roster_positions, [])
+        self._sub_roster_slices = []
+        start = 0
+        for sub_roster in sub_roster_positions:
+            self._sub_roster_slices.append(slice(start, start + len(sub_roster)))
+            start += len(sub_roster)
+
+        self._compiled_players = LRUCache(maxsize=_compiled_players_cache_size)
+        self._team_codes = { "ALL": 0 }
+
+    def _compile_player(self, player):
+        """
+        Array version of player, cached by player (not card id, which may be
+        blank, duplicated or reused by an updated card)
+
+        """
+        cached = self._compiled_players.get(id(player))
+        if cached is not None:
+            return cached[1]
+
+        attributes = np.array([ player.gp_attributes[attribute] for attribute in self._attributes ])
+
+        # boosts for attributes that aren't weighted can't change any scores
+        boosts = [ (self._team_code(boost.team), self._attribute_index[boost.attribute], boost.value)
+                   for boost in player.boosts if boost.attribute in self._attribute_index ]
+
+        compiled_player = _CompiledPlayer(position=self._position_index[player.position],
+                                          team=self._team_code(player.team), attributes=attributes,
+                                          boosts=boosts)
+        # keeping the player means its id isn't reused while it's cached
+        self._compiled_players.set(id(player), (player, compiled_player))
+
+        return compiled_player
+
+    def invalidate(self, card_ids):
+        """
+        Drop compiled players & cached position scores of cards with card ids (eg
+        cards changed between database loads, see database.DatabaseDiff), so the
+        old players aren't kept
+
+        """
+        card_ids = set(card_ids)
+
+        player_ids = [ player_id for player_id, (player, compiled_player) in self._compiled_players.items()
+                       if player.misc_attributes['CARDID'] in card_ids ]
+        self._compiled_players.discard(player_ids)
+
+        if self.position_cache is not None:
+            player_ids = set(player_ids)
+            self.position_cache.discard([ key for key in self.position_cache if key[0] in player_ids ])
+
+    def _team_code(self, team_name):
+        """
+        Integer code for team name ("ALL" is always 0)
+
+        """
+        team_code = self._team_codes.get(team_name)
+        if team_code is None:
+            team_code = len(self._team_codes)
+            self._team_codes[team_name] = team_code
+
+        return team_code
+
+    def upper_bounds(self, players, top_k=None):
+        """
+        Upper bounds of position scores for players (see UpperBounds)
+
+        """
+        return UpperBounds(self, players, top_k=top_k)
+
+    def evaluator(self, team, score_func=None):
+        """
+        Incremental evaluator for swapping players on team (see SwapEvaluator)
+
+        """
+        return SwapEvaluator(self, team, score_func=score_func)
+
+    def marginal_gains(self, team, players, score_func):
+        """
+        Change in score_func(team scores) from putting each of players in each
+        roster position of team they can fill (see SwapEvaluator.marginal_gains)
+
+        """
+        return self.evaluator(team, score_func).marginal_gains(players)
+
+    def best_upgrades(self, team, players, score_func, num_upgrades=None):
+        """
+        List of (gain, roster position, player) for the swaps that improve team
+        the most, best first ("shopping list" of upgrades)
+
+        """
+        upgrades = []
+        for roster_position, (swap_players, gains) in six.iteritems(self.marginal_gains(team, players, score_func)):
+            upgrades.extend((gain, roster_position, player)
+                            for gain, player in zip(gains.tolist(), swap_players) if gain > 0)
+
+        upgrades.sort(key=operator.itemgetter(0), reverse=True)
+
+        return upgrades[:num_upgrades]
+
+    def score(self, team):
+        """
+        Team scores only, skipping all per player attributes
+
+        Returns the same overall/offense/defense/special -> raw/rounded dict as
+        calculate(team)[1], so objective functions work on either
+
+        """
+        if self.position_cache is not None:
+            return self._score_cached(team)
+
+        positions, raw, boosted = self._roster_attributes([ team ])
+        scores_raw, scores_rounded = self._position_scores(positions[0], boosted[0])
+
+        return _float_scores(self._team_scores(scores_raw, scores_rounded))
+
+    def position_scores(self, team):
+        """
+        dict of roster position -> (raw, rounded) score of team's player there
+
+        """
+        positions, raw, boosted = self._roster_attributes([ team ])
+        scores_raw, scores_rounded = self._position_scores(positions[0], boosted[0])
+
+        return { roster_position: score for roster_position, score
+                 in zip(self._roster_positions, zip(scores_raw.tolist(), scores_rounded.tolist())) }
+
+    def _score_cached(self, team):
+        """
+        score() using cached (raw, rounded) position scores
+
+        A player's position score only depends on the player and the boosts that
+        apply to their team, so those (in the order they are applied) are the cache
+        key.  Players are keyed by id, which is safe since cached scores keep them
+
+        """
+        roster = team.roster.items()
+        position_cache = self.position_cache
+
+        compiled_players = dict()
+        boosts = []
+        for roster_position, player in roster:
+            compiled_player = self._compile_player(player)
+            compiled_players[roster_position] = compiled_player
+            boosts.extend(compiled_player.boosts)
+
+        # boosts that apply to each team
+        team_boosts = dict()
+        for compiled_player in compiled_players.values():
+            if compiled_player.team not in team_boosts:
+                team_boosts[compiled_player.team] = tuple(boost for boost in boosts
+                                                          if boost[0] == 0 or boost[0] == compiled_player.team)
+
+        roster = dict(roster)
+        keys = [ (id(roster[roster_position]), team_boosts[compiled_players[roster_position].team])
+                 for roster_position in self._roster_positions ]
+
+        scores = [ cached if cached is None else cached[0] for cached in position_cache.get_many(keys) ]
+        missing = [ (islot, compiled_players[self._roster_positions[islot]], key)
+                    for islot, (key, score) in enumerate(zip(keys, scores)) if score is None ]
+
+        if len(missing) > 0:
+            raw = np.array([ c.attributes for islot, c, key in missing ])
+            positions = np.array([ c.position for islot, c, key in missing ])
+
+            # key already has the boosts for each player, in order
+            boosted = raw.copy()
+            for irow, (islot, c, (player_id, player_boosts)) in enumerate(missing):
+                for boost_team, attribute, value in player_boosts:
+                    boosted[irow, attribute] += value
+
+            scores_raw, scores_rounded = self._position_scores(positions, _cap(raw, boosted))
+
+            for (islot, c, key), score in zip(missing, zip(scores_raw.tolist(), scores_rounded.tolist())):
+                position_cache.set(key, (score, roster[self._roster_positions[islot]]))
+                scores[islot] = score
+
+        # same (sequential) sums as _team_scores
+        scores_raw, scores_rounded = zip(*scores)
+
+        team_attributes = dict()
+        for sub_roster_name, sub_roster_slice in zip(_sub_roster_names, self._sub_roster_slices):
+            sub_roster_size = len(scores_raw[sub_roster_slice])
+            team_attributes[sub_roster_name] = {
+                'raw': sum(scores_raw[sub_roster_slice]) / sub_roster_size,
+                'rounded': sum(scores_rounded[sub_roster_slice]) / sub_roster_size }
+
+        team_attributes['overall'] = {
+            'raw': sum(scores_raw) / len(scores_raw),
+            'rounded': sum(scores_rounded) / len(scores_rounded) }
+
+        return team_attributes
+
+    def calculate_many(self, teams):
+        """
+        Team scores for many teams in one vectorized pass
+
+        Returns dict of overall/offense/defense/special -> raw/rounded -> array of
+        scores (one per team), same values as calculate() gives for each team
+
+        """
+        positions, raw, boosted = self._roster_attributes(teams)
+        scores_raw, scores_rounded = self._position_scores(positions, boosted)
+
+        return self._team_scores(scores_raw, scores_rounded)
+
+    def compile_players(self, players):
+        """
+        Arrays of list of players for calculate_rosters
+
+        """
+        compiled_players = [ self._compile_player(player) for player in players ]
+
+        boost_count = np.array([ len(c.boosts) for c in compiled_players ], dtype=int)
+        boosts = np.array([ boost for c in compiled_players for boost in c.boosts ], dtype=float).reshape(-1, 3)
+
+        return _CompiledPlayers(positions=np.array([ c.position for c in compiled_players ], dtype=int),
+                                teams=np.array([ c.team for c in compiled_players ], dtype=int),
+                                attributes=np.array([ c.attributes for c in compiled_players ]),
+                                boost_start=np.cumsum(boost_count) - boost_count, boost_count=boost_count,
+                                boost_teams=boosts[:, 0], boost_attributes=boosts[:, 1].astype(int),
+                                boost_values=boosts[:, 2])
+
+    def calculate_rosters(self, compiled_players, rosters):
+        """
+        calculate_many for rosters given as array of indices into compiled players
+        (from compile_players) of team x roster position, in _team_positions order
+
+        Same scores as calculate_many gives for the teams, without making them
+
+        """
+        rosters = np.asarray(rosters)
+        num_teams = len(rosters)
+
+        # boosts (team index, boost team, attribute, value) in the same order as
+        # _roster_attributes gathers them, ie by roster position in _team_positions order
+        counts = compiled_players.boost_count[rosters]
+        team_counts = counts.sum(axis=1)
+        counts = counts.ravel()
+        boost_rows = (np.repeat(compiled_players.boost_start[rosters].ravel() - (np.cumsum(counts) - counts), counts) +
+                      np.arange(counts.sum()))
+
+        boosts = np.column_stack([ np.repeat(np.arange(num_teams), team_counts),
+                                   compiled_players.boost_teams[boost_rows],
+                                   compiled_players.boost_attributes[boost_rows],
+                                   compiled_players.boost_values[boost_rows] ])
+
+        # attributes are in calculator's roster position order
+        rosters = rosters[:, [ _team_position_index[pos] for pos in self._roster_positions ]]
+        positions = compiled_players.positions[rosters]
+        raw = compiled_players.attributes[rosters]
+
+        boosted = self._boost_rosters(raw, compiled_players.teams[rosters], boosts)
+        scores_raw, scores_rounded = self._position_scores(positions, boosted)
+
+        return self._team_scores(scores_raw, scores_rounded)
+
+    def _calculate_compiled(self, team):
+        """
+        calculate() using arrays of (roster position x attribute)
+
+        """
+        positions, raw, boosted = self._roster_attributes([team])
+        positions, raw, boosted = positions[0], raw[0], boosted[0]
+
+        scores_raw, scores_rounded = self._position_scores(positions, boosted)
+        team_attributes = _float_scores(self._team_scores(scores_raw, scores_rounded))
+
+        # per player attributes are only needed for reporting
+        player_attributes = dict(raw=dict(), boosted=dict())
+        raw = raw.tolist()
+        boosted = boosted.tolist()
+        for irow, roster_position in enumerate(self._roster_positions):
+            position_attributes = self._position_attributes[positions[irow]]
+            position_columns = self._position_columns[positions[irow]]
+
+            player_attributes['raw'][roster_position] = dict(zip(position_attributes,
+                                                                 position_columns(raw[irow])))
+            player_attributes['boosted'][roster_position] = dict(zip(position_attributes,
+                                                                     position_columns(boosted[irow])))
+
+        return player_attributes, team_attributes
+
+    def _roster_attributes(self, teams):
+        """
+        Player positions (team x roster position) and raw & boosted attributes
+        (team x roster position x attribute) arrays for list of teams
+
+        """
+        roster_positions = self._roster_positions
+        rosters = [ dict(team.roster) for team in teams ]
+        compiled_rosters = [ [ self._compile_player(roster[pos]) for pos in roster_positions ]
+                             for roster in rosters ]
+
+        positions = np.array([ [ c.position for c in roster ] for roster in compiled_rosters ])
+        player_teams = np.array([ [ c.team for c in roster ] for roster in compiled_rosters ])
+        raw = np.array([ [ c.attributes for c in roster ] for roster in compiled_rosters ])
+
+        # gather boosts (team index, boost team, attribute, value) in the same order as calculate()
+        boosts = [ (iteam,) + boost
+                   for iteam, team in enumerate(teams)
+                   for player in team.roster.values()
+                   for boost in self._compile_player(player).boosts ]
+
+        return positions, raw, self._boost_rosters(raw, player_teams, boosts)
+
+    def _boost_rosters(self, raw, player_teams, boosts):
+        """
+        Apply boosts to raw attributes (team x roster position x attribute) and cap them
+
+        boosts is list of (team index, boost team code, attribute, value).  Each team's
+        boosts are applied in order to players on that team with the boost's team code
+
+        """
+        boosted = raw.copy()
+        if len(boosts) > 0:
+            boost_teams, boost_team_codes, boost_attributes, boost_values = np.array(boosts).T
+            boost_teams = boost_teams.astype(int)
+            boost_attributes = boost_attributes.astype(int)
+
+            # (boost x roster position) mask of players each boost applies to
+            boost_mask = ((player_teams[boost_teams] == boost_team_codes[:, None]) |
+                          (boost_team_codes[:, None] == 0))
+            boost_deltas = boost_values[:, None] * boost_mask
+
+            if raw.shape[0] == 1:
+                # single roster, just add boosts one at a time
+                for boost_attribute, boost_delta in zip(boost_attributes, boost_deltas):
+                    boosted[0, :, boost_attribute] += boost_delta
+
+                return _cap(raw, boosted)
+
+            # apply the i-th boost of every team at once, so each team's boosts are
+            # still added one at a time and in order
+            order = np.argsort(boost_teams, kind='mergesort')
+            first_boost = np.searchsorted(boost_teams[order], boost_teams[order])
+            boost_ranks = np.empty_like(order)
+            boost_ranks[order] = np.arange(len(order)) - first_boost
+
+            roster_slots = np.arange(raw.shape[1])[None, :]
+            for rank in range(boost_ranks.max() + 1):
+                rank_boosts = boost_ranks == rank
+                boosted[boost_teams[rank_boosts][:, None], roster_slots,
+                        boost_attributes[rank_boosts][:, None]] += boost_deltas[rank_boosts]
+
+        return _cap(raw, boosted)
+
+    def _position_scores(self, positions, boosted):
+        """
+        Raw & rounded score of each roster position (last axis of boosted is attributes,
+        any leading axes are kept)
+
+        """
+        # weighted sums, accumulated sequentially in weights order
+        weight_order = self._weight_order[positions]
+        weighted_values = np.take_along_axis(boosted, weight_order, axis=-1)
+        weighted_values *= self._weight_values[positions]
+        weighted_score = np.cumsum(weighted_values, axis=-1)[..., -1] / self._total[positions]
+
+        low = self._low[positions]
+        scaler = self._scaler[positions]
+        scores_raw = scaler * (weighted_score - low)
+        scores_rounded = np.trunc(scaler * (_round(weighted_score) - low))
+
+        return scores_raw, scores_rounded
+
+    def _team_scores(self, scores_raw, scores_rounded):
+        """
+        Sub roster & overall team scores from roster position scores (last axis
+        of scores is roster position)
+
+        """
+        team_attributes = dict()
+        for sub_roster_name, sub_roster_slice in zip(_sub_roster_names, self._sub_roster_slices):
+            sub_roster_raw = scores_raw[..., sub_roster_slice]
+            sub_roster_size = sub_roster_raw.shape[-1]
+
+            team_attributes[sub_roster_name] = {
+                'raw': np.cumsum(sub_roster_raw, axis=-1)[..., -1] / sub_roster_size,
+                'rounded': scores_rounded[..., sub_roster_slice].sum(axis=-1) / sub_roster_size }
+
+        roster_size = scores_raw.shape[-1]
+        team_attributes['overall'] = {
+            'raw': np.cumsum(scores_raw, axis=-1)[..., -1] / roster_size,
+            'rounded': scores_rounded.sum(axis=-1) / roster_size }
+
+        return team_attributes
 
 
     def _load_weight_file(self, weight_file):
@@ -164,4 +648,619 @@ class Standard(object):
                                          "[ row {}, col {}".format(value, irow, icol))
 
         weights = dict(weights)
-        return weights
\ No newline at end of file
+        return weights
+
+
+class MultiStandard(Standard):
+    """
+    Standard overall ratings under several weight files at once
+
+    Players are boosted once and scored under every weight file in one pass.
+    score() and calculate_many() return the same dicts as Standard, but each
+    value has a leading axis of weight files (in weight_files order), and
+    calculate() returns the list of Standard.calculate results.  Use
+    combined_score_func to turn those into a single objective (eg worst case
+    over weight files) for the optimizers.
+
+    Incremental evaluation (evaluator, marginal_gains, best_upgrades), upper
+    bounds and position_scores need a single weight file, and raise ValueError.
+
+    All weight files must rate the same player positions
+    """
+
+    def __init__(self, weight_files):
+        self.weight_files = list(weight_files)
+        self.calculators = [ Standard(weight_file, compiled=True) for weight_file in self.weight_files ]
+
+        self.compiled = True
+        self.position_cache = None
+        self._compile_weights()
+
+    def calculate(self, team):
+        return [ calculator.calculate(team) for calculator in self.calculators ]
+
+    def score(self, team):
+        """
+        Team scores under each weight file (see Standard.score)
+
+        """
+        positions, raw, boosted = self._roster_attributes([ team ])
+        scores_raw, scores_rounded = self._position_scores(positions[0], boosted[0])
+
+        return self._team_scores(scores_raw, scores_rounded)
+
+    def position_scores(self, team):
+        # scores have a weight file axis, which callers comparing them don't expect
+        _check_single_weight_file(self, "Position scores")
+
+    def combined_score_func(self, score_func, combine=np.min):
+        """
+        Function of team scores giving score_func combined across weight files
+
+        combine is applied over the weight file axis, eg np.min (worst case) or np.mean:
+
+            multi_score_func = calc.combined_score_func(lambda s: s['overall']['rounded'], np.mean)
+            obj_func = lambda team: multi_score_func(calc.score(team))
+            batch_obj_func = lambda teams: multi_score_func(calc.calculate_many(teams))
+
+        """
+        return lambda team_attributes: combine(score_func(team_attributes), axis=0)
+
+    def _compile_weights(self):
+        """
+        Stack compiled weights of each weight file (weight file x position x ...),
+        with attributes indexed by the union of all weight files' attributes
+
+        """
+        positions = self.calculators[0]._positions
+        for weight_file, calculator in zip(self.weight_files, self.calculators):
+            if calculator._positions != positions:
+                raise ValueError("{} rates positions {}, expected {}".format(weight_file, calculator._positions,
+                                                                             positions))
+
+        attributes = []
+        for calculator in self.calculators:
+            attributes.extend(a for a in calculator._attributes if a not in attributes)
+
+        attribute_index = { attribute: i for i, attribute in enumerate(attributes) }
+        num_weights = max(calculator._weight_order.shape[1] for calculator in self.calculators)
+
+        # padded weights are zero, which doesn't change each weight file's (sequential) sums
+        weight_order = np.zeros((len(self.calculators), len(positions), num_weights), dtype=int)
+        weight_values = np.zeros((len(self.calculators), len(positions), num_weights))
+
+        for icalculator, calculator in enumerate(self.calculators):
+            union_index = np.array([ attribute_index[a] for a in calculator._attributes ])
+            calculator_weights = calculator._weight_order.shape[1]
+
+            weight_order[icalculator, :, :calculator_weights] = union_index[calculator._weight_order]
+            weight_values[icalculator, :, :calculator_weights] = calculator._weight_values
+
+        self._positions = positions
+        self._position_index = { p: i for i, p in enumerate(positions) }
+        self._attributes = attributes
+        self._attribute_index = attribute_index
+        self._weight_order = weight_order
+        self._weight_values = weight_values
+        self._total = np.array([ calculator._total for calculator in self.calculators ])
+        self._low = np.array([ calculator._low for calculator in self.calculators ])
+        self._scaler = np.array([ calculator._scaler for calculator in self.calculators ])
+
+        self._roster_positions = self.calculators[0]._roster_positions
+        self._sub_roster_slices = self.calculators[0]._sub_roster_slices
+
+        self._compiled_players = LRUCache(maxsize=_compiled_players_cache_size)
+        self._team_codes = { "ALL": 0 }
+
+    def _position_scores(self, positions, boosted):
+        """
+        Raw & rounded score of each roster position under each weight file (weight
+        file x any leading axes of boosted)
+
+        """
+        weight_order = self._weight_order[:, positions]
+        boosted = np.broadcast_to(boosted, (len(self.calculators),) + boosted.shape)
+
+        weighted_values = np.take_along_axis(boosted, weight_order, axis=-1)
+        weighted_values *= self._weight_values[:, positions]
+        weighted_score = np.cumsum(weighted_values, axis=-1)[..., -1] / self._total[:, positions]
+
+        low = self._low[:, positions]
+        scaler = self._scaler[:, positions]
+        scores_raw = scaler * (weighted_score - low)
+        scores_rounded = np.trunc(scaler * (_round(weighted_score) - low))
+
+        return scores_raw, scores_rounded
+
+
+class SwapEvaluator(object):
+    """
+    Team scores that are updated incrementally as players are swapped
+
+    Only the swapped roster position, and roster positions whose boosts are changed
+    by the players swapped in & out, are rescored.  Scores are the same as
+    Standard.calculate gives for the swapped team.
+
+    score_func: optional function of team scores (dict like calculate()[1], values
+                may be arrays) to objective value, eg lambda s: s['overall']['rounded'].
+                If None, team scores are returned as is
+
+    """
+
+    def __init__(self, calculator, team, score_func=None):
+        _check_single_weight_file(calculator, "Incremental evaluation")
+
+        self.calculator = calculator
+        self.score_func = score_func
+
+        self.team = team.copy()
+
+        roster_positions = calculator._roster_positions
+        self._slot_index = { pos: i for i, pos in enumerate(roster_positions) }
+
+        # boosts are applied in roster order, same as calculate()
+        self._boost_order = [ self._slot_index[pos] for pos in self.team.roster.keys() ]
+
+        roster = dict(team.roster)
+        self._compiled_players = [ calculator._compile_player(roster[pos]) for pos in roster_positions ]
+        self._player_teams = np.array([ c.team for c in self._compiled_players ])
+
+        positions, raw, boosted = calculator._roster_attributes([ team ])
+        self._positions = positions[0]
+        self._raw = raw[0]
+        self._scores_raw, self._scores_rounded = calculator._position_scores(positions[0], boosted[0])
+
+    @property
+    def scores(self):
+        """
+        Current team scores (same as calculate()[1])
+
+        """
+        return _float_scores(self.calculator._team_scores(self._scores_raw, self._scores_rounded))
+
+    @property
+    def objective(self):
+        """
+        Current objective value (or team scores if there is no score_func)
+
+        """
+        return self._objective(self.scores)
+
+    def score_swaps(self, roster_position, players):
+        """
+        Objective values (or team scores as arrays) if each of players was put
+        in roster_position.  Team itself is not changed
+
+        """
+        scores_raw, scores_rounded = self._swap_scores(self._slot_index[roster_position], players)
+
+        return self._objective(self.calculator._team_scores(scores_raw, scores_rounded))
+
+    def score_swaps_many(self, swaps):
+        """
+        score_swaps for each of list of (roster position, players), scored in one pass
+
+        Unboosted players are scored only once for all roster positions that
+        don't swap boosts out, since their position score is the same in any of them
+
+        """
+        if len(swaps) == 0:
+            return []
+
+        slots = [ self._slot_index[roster_position] for roster_position, players in swaps ]
+        unboosted_slots = [ islot for islot in slots if len(self._compiled_players[islot].boosts) == 0 ]
+
+        # position scores of unboosted players with the team's current boosts
+        unboosted_index = dict()
+        if len(unboosted_slots) > 0:
+            candidates = []
+            for roster_position, players in swaps:
+                for player in players:
+                    candidate = self.calculator._compile_player(player)
+                    if len(candidate.boosts) == 0 and id(player) not in unboosted_index:
+                        unboosted_index[id(player)] = len(candidates)
+                        candidates.append(candidate)
+
+            if len(candidates) > 0:
+                affected, (unboosted_raw, unboosted_rounded) = self._rescore(unboosted_slots[0], candidates)
+
+        scores_raw = []
+        scores_rounded = []
+        for islot, (roster_position, players) in zip(slots, swaps):
+            slot_raw = np.tile(self._scores_raw, (len(players), 1))
+            slot_rounded = np.tile(self._scores_rounded, (len(players), 1))
+
+            if islot in unboosted_slots:
+                rows = [ unboosted_index.get(id(player)) for player in players ]
+            else:
+                rows = [ None ] * len(players)
+
+            unboosted_rows = [ i for i, row in enumerate(rows) if row is not None ]
+            if len(unboosted_rows) > 0:
+                slot_raw[unboosted_rows, islot] = unboosted_raw[[ rows[i] for i in unboosted_rows ], 0]
+                slot_rounded[unboosted_rows, islot] = unboosted_rounded[[ rows[i] for i in unboosted_rows ], 0]
+
+            boosted_rows = [ i for i, row in enumerate(rows) if row is None ]
+            if len(boosted_rows) > 0:
+                slot_raw[boosted_rows], slot_rounded[boosted_rows] = (
+                    self._swap_scores(islot, [ players[i] for i in boosted_rows ]))
+
+            scores_raw.append(slot_raw)
+            scores_rounded.append(slot_rounded)
+
+        team_scores = self.calculator._team_scores(np.concatenate(scores_raw), np.concatenate(scores_rounded))
+
+        # and split back up by roster position
+        splits = np.cumsum([ len(players) for roster_position, players in swaps ])[:-1]
+
+        if self.score_func is None:
+            team_scores = { sub_roster_name: { stat: np.split(values, splits) for stat, values in six.iteritems(stats) }
+                            for sub_roster_name, stats in six.iteritems(team_scores) }
+
+            return [ { sub_roster_name: { stat: values[iswap] for stat, values in six.iteritems(stats) }
+                       for sub_roster_name, stats in six.iteritems(team_scores) }
+                     for iswap in range(len(swaps)) ]
+
+        return np.split(self.score_func(team_scores), splits)
+
+    def marginal_gains(self, players, roster_positions=None):
+        """
+        Change in objective from putting each of players in each roster position
+        they can fill
+
+        Players already on the team (in another roster position) are skipped.
+        Returns dict of roster position -> (players, array of objective changes)
+
+        """
+        if roster_positions is None:
+            roster_positions = self.calculator._roster_positions
+
+        current_obj = self._score_func_required(self.scores)
+
+        swaps = []
+        for roster_position in roster_positions:
+            allowable_positions = _allowable_player_positions[roster_position]
+            swap_players = [ player for player in players
+                             if player.position in allowable_positions and
+                             not self.team.contains(player, exclude_position=roster_position) ]
+            swaps.append((roster_position, swap_players))
+
+        gains = dict()
+        for (roster_position, swap_players), swap_obj in zip(swaps, self.score_swaps_many(swaps)):
+            gains[roster_position] = (swap_players, swap_obj - current_obj)
+
+        return gains
+
+    def _swap_scores(self, islot, players):
+        """
+        (raw, rounded) roster position scores (player x roster position) if each
+        of players was put in islot
+
+        """
+        candidates = [ self.calculator._compile_player(player) for player in players ]
+
+        scores_raw = np.tile(self._scores_raw, (len(candidates), 1))
+        scores_rounded = np.tile(self._scores_rounded, (len(candidates), 1))
+
+        # if no boosts are swapped in or out, only this roster position changes, so
+        # keep those candidates apart from ones that rescore other roster positions too
+        if len(self._compiled_players[islot].boosts) == 0:
+            groups = [ [ i for i, c in enumerate(candidates) if len(c.boosts) == 0 ],
+                       [ i for i, c in enumerate(candidates) if len(c.boosts) > 0 ] ]
+        else:
+            groups = [ list(range(len(candidates))) ]
+
+        for group in groups:
+            if len(group) == 0:
+                continue
+
+            affected, (group_raw, group_rounded) = self._rescore(islot, [ candidates[i] for i in group ])
+
+            scores_raw[np.ix_(group, affected)] = group_raw
+            scores_rounded[np.ix_(group, affected)] = group_rounded
+
+        return scores_raw, scores_rounded
+
+    def bound_swaps(self, roster_position, players, upper_bounds):
+        """
+        Upper bounds of objective values if each of players was put in roster_position
+        (inf for swaps that change any boosts, since those aren't bounded)
+
+        upper_bounds is UpperBounds for players.  Needs a score_func that never
+        decreases when a position score increases
+
+        """
+        islot = self._slot_index[roster_position]
+
+        scores_raw = np.tile(self._scores_raw, (len(players), 1))
+        scores_rounded = np.tile(self._scores_rounded, (len(players), 1))
+        bounded = np.array([ len(self.calculator._compile_player(player).boosts) == 0 for player in players ],
+                           dtype=bool)
+
+        if len(self._compiled_players[islot].boosts) > 0:
+            bounded[:] = False
+
+        for i, player in enumerate(players):
+            if bounded[i]:
+                scores_raw[i, islot], scores_rounded[i, islot] = upper_bounds.get(player)
+
+        bounds = self._score_func_required(self.calculator._team_scores(scores_raw, scores_rounded))
+
+        return np.where(bounded, bounds, np.inf)
+
+    def bound_moves(self, moves, upper_bounds):
+        """
+        Upper bound of objective value after list of (roster position, player) swaps
+        (inf if they change any boosts).  See bound_swaps
+
+        """
+        scores_raw = self._scores_raw.copy()
+        scores_rounded = self._scores_rounded.copy()
+        compiled_players = list(self._compiled_players)
+
+        for roster_position, player in moves:
+            islot = self._slot_index[roster_position]
+            compiled_player = self.calculator._compile_player(player)
+            if len(compiled_players[islot].boosts) > 0 or len(compiled_player.boosts) > 0:
+                return np.inf
+
+            compiled_players[islot] = compiled_player
+            scores_raw[islot], scores_rounded[islot] = upper_bounds.get(player)
+
+        return self._score_func_required(self.calculator._team_scores(scores_raw, scores_rounded))
+
+    def swap(self, roster_position, player):
+        """
+        Put player in roster_position and update scores
+
+        """
+        self.team.set_position(roster_position, player)
+
+        islot = self._slot_index[roster_position]
+        candidate = self.calculator._compile_player(player)
+        affected, (scores_raw, scores_rounded) = self._rescore(islot, [ candidate ])
+
+        self._compiled_players[islot] = candidate
+        self._player_teams[islot] = candidate.team
+        self._positions[islot] = candidate.position
+        self._raw[islot] = candidate.attributes
+        self._scores_raw[affected] = scores_raw[0]
+        self._scores_rounded[affected] = scores_rounded[0]
+
+    def copy(self):
+        """
+        Independent copy of this evaluator (and its team)
+
+        """
+        other = copy.copy(self)
+        other.team = self.team.copy()
+        other._compiled_players = list(self._compiled_players)
+        other._player_teams = self._player_teams.copy()
+        other._positions = self._positions.copy()
+        other._raw = self._raw.copy()
+        other._scores_raw = self._scores_raw.copy()
+        other._scores_rounded = self._scores_rounded.copy()
+
+        return other
+
+    def _score_func_required(self, team_attributes):
+        if self.score_func is None:
+            raise ValueError("Evaluator needs a score_func for this")
+
+        return self.score_func(team_attributes)
+
+    def _objective(self, team_attributes):
+        if self.score_func is None:
+            return team_attributes
+
+        return self.score_func(team_attributes)
+
+    def _rescore(self, islot, candidates):
+        """
+        Roster positions affected by putting each of candidates in islot and their
+        new (raw, rounded) scores (candidate x affected roster position)
+
+        """
+        compiled_players = self._compiled_players
+
+        # only players on teams whose boosts are swapped in or out are affected
+        boost_teams = set(boost[0] for c in [ compiled_players[islot] ] + candidates for boost in c.boosts)
+        if 0 in boost_teams:
+            affected = np.arange(len(compiled_players))
+        else:
+            affected = np.flatnonzero(np.in1d(self._player_teams, list(boost_teams)))
+            affected = np.union1d(affected, [ islot ]).astype(int)
+
+        iswap = np.searchsorted(affected, islot)
+
+        raw = np.tile(self._raw[affected], (len(candidates), 1, 1))
+        raw[:, iswap] = [ c.attributes for c in candidates ]
+        player_teams = np.tile(self._player_teams[affected], (len(candidates), 1))
+        player_teams[:, iswap] = [ c.team for c in candidates ]
+        positions = np.tile(self._positions[affected], (len(candidates), 1))
+        positions[:, iswap] = [ c.position for c in candidates ]
+
+        # boosts in roster order, with candidate's boosts in place of the outgoing player's
+        iorder = self._boost_order.index(islot)
+        boosts_before = [ boost for jslot in self._boost_order[:iorder] for boost in compiled_players[jslot].boosts ]
+        boosts_after = [ boost for jslot in self._boost_order[iorder + 1:] for boost in compiled_players[jslot].boosts ]
+
+        if all(len(c.boosts) == 0 for c in candidates):
+            # every candidate sees the same boosts, so boost them all as one big roster
+            boosts = [ (0,) + boost for boost in boosts_before + boosts_after ]
+            boosted = self.calculator._boost_rosters(raw.reshape(1, -1, raw.shape[-1]),
+                                                     player_teams.reshape(1, -1), boosts)
+            boosted = boosted.reshape(raw.shape)
+        else:
+            boosts = [ (icandidate,) + boost
+                       for icandidate, c in enumerate(candidates)
+                       for boost in boosts_before + c.boosts + boosts_after ]
+            boosted = self.calculator._boost_rosters(raw, player_teams, boosts)
+
+        return affected, self.calculator._position_scores(positions, boosted)
+
+
+class UpperBounds(object):
+    """
+    Guaranteed upper bounds of each player's position score, used to screen out
+    swaps before scoring them exactly
+
+    A player's attributes can't be boosted by more than the positive boosts of the
+    (roster size) players in *players* that boost the most for their team, so scoring
+    each player with those boosts gives an upper bound that doesn't depend on the
+    rest of the team.  Screening only uses bounds for swaps that don't change any
+    boosts, and only for objectives that never decrease when a position score
+    increases (eg, any raw or rounded team score).
+
+    top_k:  if not None, at most this many swaps (with highest bounds) that could
+            improve on the incumbent are scored exactly per screening.  Swaps that
+            change boosts are always scored exactly.
+
+    lower gives lower bounds the same way (with the most harmful boosts).
+
+    num_screened & num_evaluated count swaps screened out & scored exactly
+
+    """
+
+    def __init__(self, calculator, players, top_k=None):
+        _check_single_weight_file(calculator, "Upper bounds")
+
+        self.top_k = top_k
+        self.num_screened = 0
+        self.num_evaluated = 0
+
+        # bounds are keyed by player id, so keep the players
+        players = list(players)
+        self._players = players
+
+        compiled_players = [ calculator._compile_player(player) for player in players ]
+        roster_size = len(calculator._roster_positions)
+        num_attributes = len(calculator._attributes)
+
+        # total boost each player gives to each (team code, attribute)
+        player_boosts = defaultdict(lambda : defaultdict(float))
+        for iplayer, c in enumerate(compiled_players):
+            for boost_team, attribute, value in c.boosts:
+                player_boosts[(boost_team, attribute)][iplayer] += value
+
+        # most any roster can boost (or reduce) each team's attributes
+        team_codes = sorted(set(c.team for c in compiled_players))
+        max_boosts = np.zeros((max(team_codes + [ 0 ]) + 1, num_attributes))
+        min_boosts = np.zeros_like(max_boosts)
+
+        for team_code in team_codes:
+            for attribute in range(num_attributes):
+                boosts = defaultdict(float)
+                for boost_team in set([ 0, team_code ]):
+                    for iplayer, value in six.iteritems(player_boosts.get((boost_team, attribute), {})):
+                        boosts[iplayer] += value
+
+                boosts = sorted(boosts.values())
+                max_boosts[team_code, attribute] = sum(b for b in boosts[-roster_size:] if b > 0)
+                min_boosts[team_code, attribute] = sum(b for b in boosts[:roster_size] if b < 0)
+
+        raw = np.array([ c.attributes for c in compiled_players ]).reshape(-1, num_attributes)
+        player_teams = np.array([ c.team for c in compiled_players ], dtype=int)
+        positions = np.array([ c.position for c in compiled_players ], dtype=int)
+
+        # capping never lowers a bigger boosted value, so bound each attribute with
+        # the biggest (or smallest, for negative weights) boost
+        most_boosted = _cap(raw, raw + max_boosts[player_teams])
+        least_boosted = _cap(raw, raw + min_boosts[player_teams])
+        boosted = np.where(calculator._weight_matrix[positions] >= 0, most_boosted, least_boosted)
+
+        scores_raw, scores_rounded = calculator._position_scores(positions, boosted)
+
+        self._bounds = dict()
+        for player, score in zip(players, zip(scores_raw.tolist(), scores_rounded.tolist())):
+            self._bounds[id(player)] = score
+
+        # and the other way around for lower bounds
+        boosted = np.where(calculator._weight_matrix[positions] >= 0, least_boosted, most_boosted)
+
+        scores_raw, scores_rounded = calculator._position_scores(positions, boosted)
+
+        self._lower_bounds = dict()
+        for player, score in zip(players, zip(scores_raw.tolist(), scores_rounded.tolist())):
+            self._lower_bounds[id(player)] = score
+
+    def get(self, player):
+        """
+        (raw, rounded) upper bound of player's position score
+
+        """
+        return self._bounds[id(player)]
+
+    def lower(self, player):
+        """
+        (raw, rounded) lower bound of player's position score, with the most
+        harmful boosts any roster could give
+
+        """
+        return self._lower_bounds[id(player)]
+
+    def screen(self, bounds, incumbent):
+        """
+        Indices of swaps with given objective bounds that still need to be
+        scored exactly to find any improvement on incumbent
+
+        """
+        bounds = np.asarray(bounds, dtype=float)
+        candidates = np.flatnonzero(bounds > incumbent)
+
+        if self.top_k is not None:
+            bounded = candidates[np.isfinite(bounds[candidates])]
+            unbounded = candidates[~np.isfinite(bounds[candidates])]
+            top = bounded[np.argsort(-bounds[bounded], kind='mergesort')[:self.top_k]]
+            candidates = np.sort(np.concatenate([ unbounded, top ]))
+
+        self.num_screened += len(bounds) - len(candidates)
+        self.num_evaluated += len(candidates)
+
+        return candidates
+
+    def __repr__(self):
+        num_swaps = self.num_screened + self.num_evaluated
+        if num_swaps > 0:
+            screened_pct = float(self.num_screened) / num_swaps
+        else:
+            screened_pct = 0.0
+
+        return ("{}({} players, screened out {} of {} swaps [{:.1%}])".format(
+                self.__class__.__name__, len(self._bounds), self.num_screened, num_swaps, screened_pct))
+
+
+def _check_single_weight_file(calculator, what):
+    if isinstance(calculator, MultiStandard):
+        raise ValueError("{} not supported for multiple weight files (MultiStandard)".format(what))
+
+
+def _float_scores(team_attributes):
+    """
+    Convert (0-d array) team scores to plain floats
+
+    """
+    return { k: { score_type: float(score) for score_type, score in six.iteritems(v) }
+             for k, v in six.iteritems(team_attributes) }
+
+
+def _cap(raw, boosted):
+    """
+    Cap boosted attributes at 99 (or raw value if that's already over 99)
+
+    """
+    return np.where(boosted > 99, np.where(raw > 99, np.minimum(raw, boosted), 99), boosted)
+
+
+def _round(values):
+    """
+    Vectorized version of built-in round (which rounds halves away from zero
+    in python 2 and to even in python 3)
+
+    """
+    if six.PY2:
+        rounded = np.floor(np.abs(values))
+        rounded += (np.abs(values) - rounded) >= 0.5
+        return np.copysign(rounded, values)
+    else:
+        return np.round(values)
@@ -60,21 +60,35 @@ class AuctionFilter(object):
         """
         Find players thatsatify this filter in given universe
 
+        universe can be a list of players or a database.PlayerDatabase (which uses
+        its indexes)
+
         """
 
-        good = []
-        for player in universe:
-          if player.auctionable == "Yes":
-            if self.name is None or self.name in player.name:
-              if self.min_ovr is None or player.ovr >= self.min_ovr:
-                if self.max_ovr is None or player.ovr <= self.max_ovr:
-                  if self.types is None or player.type in self.types:
-                    if self.teams is None or player.team in self.teams:
-                      if self.positions is None or player.position in self.positions:
-                        good.append(player)
+        if hasattr(universe, 'query'):
+            return universe.filter(self)
+
+        good = [ player for player in universe if self.matches(player) ]
 
         return good
 
+    def matches(self, player):
+        """
+        Check if a single player satisfies this filter (only uses auction house
+        searchable fields, so works on database.PlayerSummary too)
+
+        """
+        if player.auctionable == "Yes":
+          if self.name is None or self.name in player.name:
+            if self.min_ovr is None or player.ovr >= self.min_ovr:
+              if self.max_ovr is None or player.ovr <= self.max_ovr:
+                if self.types is None or player.type in self.types:
+                  if self.teams is None or player.team in self.teams:
+                    if self.positions is None or player.position in self.positions:
+                      return True
+
+        return False
+
     def merge(self, other):
         """
         Naive merge of this filter with another..
@@ -2,97 +2,1098 @@
 # Player database
 #
 
-from core import Player, PlayerBoost, _PlayerGPAttributes, _PlayerMiscAttributes
-import os, csv
+from core import Player, PlayerBoost, AuctionFilter, _PlayerGPAttributes, _PlayerMiscAttributes
+import os, csv, operator, itertools, json, shutil, hashlib, glob, multiprocessing, bisect
+import numpy as np
+import six
+from six.moves import intern
+from collections import defaultdict, namedtuple
 from datetime import datetime
 
-def import_database_csv(infile):
+try:
+  from collections.abc import Mapping
+except ImportError:
+  from collections import Mapping
+
+# columns every database export must have
+_required_columns = ([ 'PLAYER NAME', "FILTER NAME", "PROGRAM", "AUCTION", 'POS', 'TEAM', 'OVR', 'TYPE' ] +
+                     _PlayerGPAttributes + _PlayerMiscAttributes)
+
+# columns stored as category codes by import_database_columns
+_categorical_columns = [ 'POS', 'TEAM', 'TYPE', 'PROGRAM', 'AUCTION' ]
+
+# bumped whenever the snapshot layout changes
+_snapshot_version = 1
+
+_conflict_policies = [ 'last', 'first', 'error' ]
+
+_gp_attribute_index = { key: i for i, key in enumerate(_PlayerGPAttributes) }
+
+
+# cheap columns of a row, checked before parsing the rest of the player
+PlayerSummary = namedtuple("PlayerSummary", [ 'name', 'display_name', 'program', 'position', 'team', 'ovr',
+                                              'type', 'auctionable' ])
+
+
+def import_database_csv(infile, columnar=False):
   """
   Import database from a CSV file
 
+  columnar: if True, return PlayerColumns (see import_database_columns) instead of
+            list of players
+
+  """
+
+  if columnar:
+    return import_database_columns(infile)
+
+  return list(iter_database_csv(infile))
+
+
+def iter_database_csv(infile, predicate=None):
+  """
+  Generator of players from a CSV file, read one row at a time
+
+  predicate: optional function of a PlayerSummary (same fields as Player for
+             name, position, team, ovr, type, auctionable, etc) or an AuctionFilter.
+             Rows it rejects are skipped before their attributes & boosts are parsed
+
   """
 
   if not os.path.exists(infile):
     raise ValueError("Cannont find file: {}".format(infile))
 
-  required_columns = [ 'PLAYER NAME', "FILTER NAME", "PROGRAM", "AUCTION", 'POS', 'TEAM', 'OVR', 'TYPE' ]
-  required_columns += _PlayerGPAttributes
-  required_columns += _PlayerMiscAttributes
-  reader = csv.reader(open(infile))
+  if isinstance(predicate, AuctionFilter):
+    predicate = predicate.matches
+
+  with open(infile) as f:
+    reader = csv.reader(f)
+
+    #
+    # process header first
+    #
+    column_map = _column_map(next(reader))
+
+    #
+    # now read in players
+    #
+    for line in reader:
+      summary = PlayerSummary(name=normalize_name(line[column_map["FILTER NAME"]]),
+                              display_name=line[column_map["PLAYER NAME"]],
+                              program=line[column_map["PROGRAM"]],
+                              position=line[column_map["POS"]],
+                              team=line[column_map["TEAM"]],
+                              ovr=int(line[column_map["OVR"]]),
+                              type=line[column_map["TYPE"]],
+                              auctionable=line[column_map["AUCTION"]])
+
+      if predicate is not None and not predicate(summary):
+        continue
+
+      yield _parse_player(line, column_map, summary)
+
+
+def _parse_player(line, column_map, summary):
+  """
+  Player from CSV row, with PlayerSummary of its cheap columns
+
+  """
+  player_adjusted_ovr = float(line[column_map["ADJUSTED OVR"]])
+  player_date_added = _parse_date(line[column_map['DATE']])
+
+  # read in game play attributes
+  gp_attributes = dict()
+  for key in _PlayerGPAttributes:
+      val = line[column_map[key]]
+
+      # convert height into inches to make it numeric
+      if key == "HT":
+          val = _parse_height(val)
+
+      gp_attributes[key] = float(val)
+
+  misc_attributes = dict()
+  for key in _PlayerMiscAttributes:
+      misc_attributes[key] = line[column_map[key]]
+
+  player_boosts = _parse_boosts(misc_attributes["BOOST"])
+
+  return Player(name=summary.name, position=summary.position, display_name=summary.display_name,
+                program=summary.program, team=summary.team, ovr=summary.ovr, adjusted_ovr=player_adjusted_ovr,
+                type=summary.type, boosts=player_boosts, auctionable=summary.auctionable,
+                date_added=player_date_added,
+                gp_attributes=gp_attributes, misc_attributes=misc_attributes)
+
+
+def import_database_columns(infile, chunk_size=10000):
+  """
+  Import database from a CSV file into PlayerColumns
+
+  Rows are read in chunks of chunk_size and numeric columns of each chunk are
+  parsed in one step (heights & dates are only parsed once per distinct value).
+  Player objects are only created when asked for.
+
+  """
+
+  if not os.path.exists(infile):
+    raise ValueError("Cannont find file: {}".format(infile))
+
+  numeric_columns = [ key for key in _PlayerGPAttributes if key != "HT" ]
+  string_columns = [ 'PLAYER NAME', 'FILTER NAME', 'OVR', 'HT' ] + _categorical_columns
+  string_columns += [ key for key in _PlayerMiscAttributes if key not in string_columns ]
+
+  numeric_chunks = []
+  strings = { key: [] for key in string_columns }
+
+  with open(infile) as f:
+    reader = csv.reader(f)
+    column_map = _column_map(next(reader))
+    get_numeric = operator.itemgetter(*[ column_map[key] for key in numeric_columns ])
+
+    while True:
+      rows = list(itertools.islice(reader, chunk_size))
+      if len(rows) == 0:
+        break
+
+      numeric = np.fromstring(",".join([ ",".join(get_numeric(row)) for row in rows ]), sep=',')
+      if numeric.size != len(rows) * len(numeric_columns):
+        raise ValueError("Error parsing numeric columns in rows {}-{}".format(
+                         sum(len(c) for c in numeric_chunks) + 1, sum(len(c) for c in numeric_chunks) + len(rows)))
+
+      numeric_chunks.append(numeric.reshape(len(rows), len(numeric_columns)))
+
+      for key in string_columns:
+        icolumn = column_map[key]
+        strings[key].extend([ row[icolumn] for row in rows ])
+
+  if len(numeric_chunks) > 0:
+    numeric = np.concatenate(numeric_chunks)
+  else:
+    numeric = np.zeros((0, len(numeric_columns)))
+
+  attributes = np.zeros((len(numeric), len(_PlayerGPAttributes)), dtype=np.float32)
+  attributes[:, [ _PlayerGPAttributes.index(key) for key in numeric_columns ]] = numeric
+
+  heights, height_codes = np.unique(strings['HT'], return_inverse=True)
+  heights = np.array([ _parse_height(h) for h in heights ], dtype=np.float32).reshape(-1)
+  attributes[:, _PlayerGPAttributes.index('HT')] = heights[height_codes]
+
+  dates, date_codes = np.unique(strings['DATE'], return_inverse=True)
+
+  categories = dict()
+  codes = dict()
+  for key in _categorical_columns:
+    categories[key], codes[key] = np.unique(strings[key], return_inverse=True)
+
+  return PlayerColumns(display_names=strings['PLAYER NAME'], filter_names=strings['FILTER NAME'],
+                       ovr=np.array(strings['OVR'], dtype=int),
+                       adjusted_ovr=numeric[:, numeric_columns.index('ADJUSTED OVR')].copy(),
+                       attributes=attributes,
+                       dates=[ _parse_date(d) for d in dates ], date_codes=date_codes,
+                       categories=categories, codes=codes,
+                       misc_attributes={ key: strings[key] for key in _PlayerMiscAttributes })
+
+
+def import_database_files(infiles, columnar=False, processes=None, on_conflict='last'):
+  """
+  Import and merge several database CSV files (eg one export per content drop),
+  parsing them in a process pool
+
+  infiles:      list of files, or glob pattern (files are taken in sorted order)
+  columnar:     if True, return merged PlayerColumns instead of list of players
+  processes:    number of worker processes (default is number of cpus; files are
+                parsed in this process if 1)
+  on_conflict:  what to do with a CARDID in more than one row:
+                  'last':  keep the last row (ie later files update cards)
+                  'first': keep the first row
+                  'error': raise ValueError, unless the rows are identical
+
+  Players are in file order, then row order (a card kept from a duplicated row
+  is at that row's position).  Rows without a CARDID are all kept.  All headers
+  are checked before any parsing.
+
+  """
+  if isinstance(infiles, six.string_types):
+    pattern = infiles
+    infiles = sorted(glob.glob(pattern))
+    if len(infiles) == 0:
+      raise ValueError("No files match: {}".format(pattern))
+
+  if on_conflict not in _conflict_policies:
+    raise ValueError("Unknown conflict policy: {}.  Allowable policies are: {}".format(on_conflict,
+                                                                                     _conflict_policies))
+
+  errors = []
+  for infile in infiles:
+    try:
+      if not os.path.exists(infile):
+        raise ValueError("Cannont find file: {}".format(infile))
+
+      with open(infile) as f:
+        _column_map(next(csv.reader(f), []))
+    except ValueError as e:
+      errors.append("{}: {}".format(infile, e))
+
+  if len(errors) > 0:
+    raise ValueError("Can't import {} of {} files:\n{}".format(len(errors), len(infiles), "\n".join(errors)))
+
+  if processes == 1 or len(infiles) <= 1:
+    columns_list = [ import_database_columns(infile) for infile in infiles ]
+  else:
+    pool = multiprocessing.Pool(processes)
+    try:
+      columns_list = pool.map(import_database_columns, infiles)
+    finally:
+      pool.close()
+      pool.join()
+
+  player_columns = concatenate_columns(columns_list)
+
+  keep = []
+  rows = defaultdict(list)
+  for i, card_id in enumerate(player_columns.misc_attributes['CARDID']):
+    card_id = _as_str(card_id)
+    if card_id == '':
+      keep.append(i)
+    else:
+      rows[card_id].append(i)
+
+  conflicts = []
+  for card_id, card_rows in rows.items():
+    if len(card_rows) == 1:
+      keep.append(card_rows[0])
+      continue
+
+    if on_conflict == 'error' and any(player_columns[i] != player_columns[card_rows[0]] for i in card_rows[1:]):
+      conflicts.append(card_id)
+
+    if on_conflict == 'last':
+      keep.append(card_rows[-1])
+    else:
+      keep.append(card_rows[0])
+
+  if len(conflicts) > 0:
+    conflicts = sorted(set(conflicts))
+    raise ValueError("Conflicting rows for {} cards: {}".format(len(conflicts), ", ".join(conflicts)))
+
+  player_columns = player_columns.take(sorted(keep))
+
+  if columnar:
+    return player_columns
+
+  return list(player_columns)
+
+
+def players_to_columns(players):
+  """
+  PlayerColumns with the given players (eg list from import_database_csv)
+
+  """
+  if isinstance(players, PlayerColumns):
+    return players
+
+  players = list(players)
+
+  categories = dict()
+  codes = dict()
+  for key, field in zip(_categorical_columns, [ 'position', 'team', 'type', 'program', 'auctionable' ]):
+    categories[key], codes[key] = np.unique(np.array([ getattr(p, field) for p in players ] + [ '' ])[:-1],
+                                            return_inverse=True)
+
+  dates = sorted(set(p.date_added for p in players))
+  date_index = { d: i for i, d in enumerate(dates) }
+
+  attributes = np.array([ [ p.gp_attributes[key] for key in _PlayerGPAttributes ] for p in players ], dtype=np.float32)
+
+  return PlayerColumns(display_names=[ p.display_name for p in players ], filter_names=[ p.name for p in players ],
+                       ovr=np.array([ p.ovr for p in players ], dtype=int),
+                       adjusted_ovr=np.array([ p.adjusted_ovr for p in players ], dtype=float),
+                       attributes=attributes.reshape(len(players), len(_PlayerGPAttributes)),
+                       dates=dates, date_codes=np.array([ date_index[p.date_added] for p in players ], dtype=int),
+                       categories=categories, codes=codes,
+                       misc_attributes={ key: [ p.misc_attributes[key] for p in players ]
+                                         for key in _PlayerMiscAttributes })
+
+
+def concatenate_columns(columns_list):
+  """
+  Single PlayerColumns with the players of each of columns_list, in order
+
+  """
+  chain = lambda values: list(itertools.chain.from_iterable(values))
+
+  categories = dict()
+  codes = dict()
+  for key in _categorical_columns:
+    values = np.concatenate([ np.asarray(c.categories[key])[c.codes[key]] for c in columns_list ] +
+                            [ np.array([], dtype=str) ])
+    categories[key], codes[key] = np.unique(values, return_inverse=True)
+
+  dates = sorted(set(d for c in columns_list for d in c._dates))
+  date_index = { d: i for i, d in enumerate(dates) }
+  date_codes = np.concatenate([ np.array([ date_index[d] for d in c._dates ], dtype=int)[c._date_codes]
+                                for c in columns_list ] + [ np.array([], dtype=int) ])
+
+  return PlayerColumns(display_names=chain(c.display_names for c in columns_list),
+                       filter_names=chain(c.filter_names for c in columns_list),
+                       ovr=np.concatenate([ c.ovr for c in columns_list ] + [ np.array([], dtype=int) ]),
+                       adjusted_ovr=np.concatenate([ c.adjusted_ovr for c in columns_list ] + [ np.zeros(0) ]),
+                       attributes=np.concatenate([ c.attributes for c in columns_list ] +
+                                                 [ np.zeros((0, len(_PlayerGPAttributes)), dtype=np.float32) ]),
+                       dates=dates, date_codes=date_codes, categories=categories, codes=codes,
+                       misc_attributes={ key: chain(c.misc_attributes[key] for c in columns_list)
+                                         for key in _PlayerMiscAttributes })
+
+
+class PlayerColumns(object):
+  """
+  Player database stored as columns
+
+  attributes:   float32 array of game play attributes (player x _PlayerGPAttributes)
+  date_added:   datetime64 array
+  categories & codes: distinct values & per-player codes of POS, TEAM, TYPE, PROGRAM
+                & AUCTION columns (eg categories['POS'][codes['POS']] are positions)
+
+  Indexing or iterating gives Player objects (equal to import_database_csv's), which
+  are only created when first needed.  They are compact: gp_attributes &
+  misc_attributes are read-only views of a row of the columns (misc attributes are
+  decoded on access), categorical fields are shared interned strings and players
+  with the same BOOST string share parsed boosts.
+
+  """
+
+  def __init__(self, display_names, filter_names, ovr, adjusted_ovr, attributes, dates, date_codes,
+               categories, codes, misc_attributes):
+    self.display_names = display_names
+    self.filter_names = filter_names
+    self.ovr = ovr
+    self.adjusted_ovr = adjusted_ovr
+    self.attributes = attributes
+    self.categories = categories
+    self.codes = codes
+    self.misc_attributes = misc_attributes
+
+    self._dates = dates
+    self._date_codes = date_codes
+    self.date_added = np.array(dates, dtype='datetime64[D]').reshape(-1)[date_codes]
+
+    self._category_values = { name: [ intern(_as_str(value)) for value in values ]
+                              for name, values in categories.items() }
+    self._boosts = dict()
+    self._players = dict()
+
+  def column(self, name):
+    """
+    Array of values of categorical column
+
+    """
+    return self.categories[name][self.codes[name]]
+
+  def isin(self, name, values):
+    """
+    Boolean array of players whose categorical column value is any of values
+
+    """
+    return np.in1d(self.codes[name], np.flatnonzero(np.in1d(self.categories[name], list(values))))
+
+  def players(self, indices=None):
+    """
+    List of players (all, or at indices)
+
+    """
+    if indices is None:
+      indices = range(len(self))
+
+    return [ self[i] for i in indices ]
+
+  def take(self, indices):
+    """
+    PlayerColumns of players at indices
+
+    """
+    indices = np.asarray(indices, dtype=int)
+    pick = lambda values: [ values[i] for i in indices ]
+
+    return PlayerColumns(display_names=pick(self.display_names), filter_names=pick(self.filter_names),
+                         ovr=self.ovr[indices], adjusted_ovr=self.adjusted_ovr[indices],
+                         attributes=self.attributes[indices], dates=self._dates, date_codes=self._date_codes[indices],
+                         categories=self.categories, codes={ key: codes[indices] for key, codes in self.codes.items() },
+                         misc_attributes={ key: pick(values) for key, values in self.misc_attributes.items() })
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+
+    player = self._players.get(i)
+    if player is None:
+      player = self._players[i] = self._create_player(i)
+
+    return player
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def __len__(self):
+    return len(self.display_names)
+
+  def __repr__(self):
+    return "{}({} players, {} created)".format(self.__class__.__name__, len(self), len(self._players))
+
+  def _create_player(self, i):
+    boost_str = _as_str(self.misc_attributes["BOOST"][i])
+    boosts = self._boosts.get(boost_str)
+    if boosts is None:
+      boosts = self._boosts[boost_str] = _parse_boosts(boost_str)
+
+    category = lambda name: self._category_values[name][self.codes[name][i]]
+
+    return Player(name=normalize_name(_as_str(self.filter_names[i])), position=category('POS'),
+                  display_name=_as_str(self.display_names[i]), program=category('PROGRAM'), team=category('TEAM'),
+                  ovr=int(self.ovr[i]), adjusted_ovr=float(self.adjusted_ovr[i]), type=category('TYPE'),
+                  boosts=boosts, auctionable=category('AUCTION'),
+                  date_added=self._dates[self._date_codes[i]],
+                  gp_attributes=GPAttributesRow(self, i), misc_attributes=MiscAttributesRow(self, i))
+
+
+class _ColumnsRow(Mapping):
+  """
+  Read-only dict-like view of one player's row of PlayerColumns
+
+  Copying gives the same view & pickling gives a plain dict (so a single player
+  doesn't drag the whole column store along).
+
+  """
+
+  __slots__ = ('_columns', '_i')
+
+  _keys = []
+
+  def __init__(self, columns, i):
+    self._columns = columns
+    self._i = i
+
+  def __iter__(self):
+    return iter(self._keys)
+
+  def __len__(self):
+    return len(self._keys)
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  def __reduce__(self):
+    return (dict, (dict(self.items()),))
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+
+class GPAttributesRow(_ColumnsRow):
+  """
+  Player's game play attributes, read from PlayerColumns.attributes
+
+  """
+
+  __slots__ = ()
+
+  _keys = _PlayerGPAttributes
+
+  def __getitem__(self, key):
+    if key == 'ADJUSTED OVR':
+      # float32 isn't exact for adjusted ovr
+      return self._columns.adjusted_ovr.item(self._i)
+
+    return self._columns.attributes.item(self._i, _gp_attribute_index[key])
+
+
+class MiscAttributesRow(_ColumnsRow):
+  """
+  Player's misc attributes, decoded from PlayerColumns.misc_attributes on access
+
+  """
+
+  __slots__ = ()
+
+  _keys = _PlayerMiscAttributes
+
+  def __getitem__(self, key):
+    return _as_str(self._columns.misc_attributes[key][self._i])
+
+
+def load_database(infile, snapshot=True, verify_hash=False):
+  """
+  Import database from a CSV file as PlayerColumns, using a binary snapshot
+
+  The snapshot (see write_snapshot) is rebuilt whenever the CSV file has changed,
+  and its arrays are memory mapped, so reopening an unchanged database is fast and
+  processes loading the same snapshot share memory.
+
+  snapshot:     if False, always import from the CSV file (and don't write a snapshot)
+  verify_hash:  if True, check the CSV file's hash too, even if its size and mtime
+                match the snapshot
+
+  """
+  if snapshot:
+    player_columns = read_snapshot(infile, verify_hash=verify_hash)
+    if player_columns is not None:
+      return player_columns
+
+  # signature of the file as imported, in case it changes while importing
+  source = _file_signature(infile) if snapshot else None
+  player_columns = import_database_columns(infile)
+
+  if snapshot:
+    try:
+      write_snapshot(player_columns, infile, source=source)
+      snapshot_columns = read_snapshot(infile)
+    except (IOError, OSError):
+      # eg read-only directory or full disk, the imported columns still do
+      snapshot_columns = None
+
+    if snapshot_columns is not None:
+      player_columns = snapshot_columns
+
+  return player_columns
+
+
+def write_snapshot(player_columns, infile, source=None):
+  """
+  Write PlayerColumns imported from infile as binary snapshot next to it
+
+  The snapshot is a directory (infile + '.snapshot') of .npy arrays plus a
+  meta.json header with the CSV file's size, mtime & hash (source, default is
+  infile's current signature)
+
+  """
+  if source is None:
+    source = _file_signature(infile)
+
+  snapshot_dir = _snapshot_dir(infile)
+  tmp_dir = "{}.tmp{}".format(snapshot_dir, os.getpid())
+
+  if os.path.exists(tmp_dir):
+    shutil.rmtree(tmp_dir)
+  os.makedirs(tmp_dir)
+
+  try:
+    write_columns(player_columns, tmp_dir, source=source)
+  except:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    raise
+
+  # replace any old snapshot
+  if os.path.exists(snapshot_dir):
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
 
-  #
-  # process header first
-  #
-  header = next(reader)
+  try:
+    os.rename(tmp_dir, snapshot_dir)
+  except OSError:
+    # another process just wrote it
+    shutil.rmtree(tmp_dir, ignore_errors=True)
 
-  # map required columns to what's in the file
+
+def read_snapshot(infile, verify_hash=False):
+  """
+  PlayerColumns from snapshot of infile, with memory mapped arrays (or None if
+  there's no snapshot or infile has changed since it was written)
+
+  """
+  snapshot_dir = _snapshot_dir(infile)
+
+  if not os.path.exists(infile):
+    return None
+
+  meta = read_columns_meta(snapshot_dir)
+  if meta is None:
+    return None
+
+  source = meta['source']
+  current = _file_signature(infile, with_hash=False)
+  if current['size'] != source['size']:
+    return None
+
+  if verify_hash or current['mtime'] != source['mtime']:
+    # just touched files are still fine
+    if _file_signature(infile)['sha1'] != source['sha1']:
+      return None
+
+  return read_columns(snapshot_dir, meta)
+
+
+def write_columns(player_columns, out_dir, arrays=None, **meta):
+  """
+  Write PlayerColumns (and any extra arrays) to existing directory out_dir as .npy
+  files, plus meta.json with meta and what's needed to read them back
+
+  """
+  arrays = dict(arrays or {})
+  arrays.update(attributes=player_columns.attributes, adjusted_ovr=player_columns.adjusted_ovr,
+                ovr=player_columns.ovr, date_codes=player_columns._date_codes,
+                display_names=player_columns.display_names, filter_names=player_columns.filter_names)
+
+  for key in _categorical_columns:
+    arrays['codes_' + key] = player_columns.codes[key]
+
+  for key in _PlayerMiscAttributes:
+    arrays['misc_' + key] = player_columns.misc_attributes[key]
+
+  for name, values in arrays.items():
+    np.save(os.path.join(out_dir, _snapshot_file(name)), np.asarray(values))
+
+  meta.update(version=_snapshot_version, num_players=len(player_columns),
+              categories={ key: [ _as_str(c) for c in player_columns.categories[key] ]
+                           for key in _categorical_columns },
+              dates=[ d.strftime("%m/%d/%Y") for d in player_columns._dates ])
+
+  with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+    json.dump(meta, f)
+
+
+def read_columns_meta(in_dir):
+  """
+  meta.json written by write_columns (or None if missing or out of date)
+
+  """
+  meta_file = os.path.join(in_dir, 'meta.json')
+  if not os.path.exists(meta_file):
+    return None
+
+  with open(meta_file) as f:
+    meta = json.load(f)
+
+  if meta.get('version') != _snapshot_version:
+    return None
+
+  return meta
+
+
+def read_columns(in_dir, meta=None):
+  """
+  PlayerColumns written by write_columns, with memory mapped arrays
+
+  """
+  if meta is None:
+    meta = read_columns_meta(in_dir)
+    if meta is None:
+      raise ValueError("No player columns in: {}".format(in_dir))
+
+  array = lambda name: read_column_array(in_dir, name)
+
+  categories = { key: np.array([ _as_str(c) for c in meta['categories'][key] ]) for key in _categorical_columns }
+
+  return PlayerColumns(display_names=array('display_names'), filter_names=array('filter_names'),
+                       ovr=array('ovr'), adjusted_ovr=array('adjusted_ovr'), attributes=array('attributes'),
+                       dates=[ _parse_date(d) for d in meta['dates'] ], date_codes=array('date_codes'),
+                       categories=categories, codes={ key: array('codes_' + key) for key in _categorical_columns },
+                       misc_attributes={ key: array('misc_' + key) for key in _PlayerMiscAttributes })
+
+
+def read_column_array(in_dir, name):
+  """
+  Memory mapped (read-only) array written by write_columns
+
+  """
+  return np.load(os.path.join(in_dir, _snapshot_file(name)), mmap_mode='r')
+
+
+def _snapshot_dir(infile):
+  return infile + '.snapshot'
+
+
+def _snapshot_file(name):
+  return name.replace(' ', '_') + '.npy'
+
+
+def _file_signature(infile, with_hash=True):
+  """
+  Size, mtime & (optionally) sha1 of file
+
+  """
+  stat = os.stat(infile)
+  signature = dict(size=stat.st_size, mtime=stat.st_mtime)
+
+  if with_hash:
+    sha1 = hashlib.sha1()
+    with open(infile, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        sha1.update(block)
+
+    signature['sha1'] = sha1.hexdigest()
+
+  return signature
+
+
+def _as_str(value):
+  """
+  Plain str of string array value
+
+  """
+  if not isinstance(value, (bytes, str)):
+    # unicode (python 2)
+    value = value.encode('utf-8')
+  elif isinstance(value, bytes) and not isinstance(value, str):
+    # bytes (python 3)
+    value = value.decode('utf-8')
+
+  return str(value)
+
+
+def _column_map(header):
+  """
+  Map required columns to their index in header
+
+  """
   column_map = dict()
 
-  for required_column in required_columns:
+  for required_column in _required_columns:
     if required_column not in header:
       raise ValueError("File does not contain required column: {}".format(required_column))
 
     column_map[required_column] = header.index(required_column)
 
-  #
-  # now read in all players
-  #
-  players = []
-  for line in reader:
-    player_display_name = line[column_map["PLAYER NAME"]]
-    player_position = line[column_map["POS"]]
-    player_team = line[column_map["TEAM"]]
-    player_ovr = int(line[column_map["OVR"]])
-    player_type = line[column_map["TYPE"]]
-    player_name = line[column_map["FILTER NAME"]]
-    player_program = line[column_map["PROGRAM"]]
-    player_auctionable = line[column_map["AUCTION"]]
-    player_adjusted_ovr = float(line[column_map["ADJUSTED OVR"]])
-    player_date_added = datetime.strptime(line[column_map['DATE']], "%m/%d/%Y")
-
-    # just concat all parts of name, ignoring what is first & last and normalize case
-    player_name = " ".join(player_name.split(', ')).lower()
-
-    # read in game play attributes
-    gp_attributes = dict()
-    for key in _PlayerGPAttributes:
-        val = line[column_map[key]]
-
-        # convert height into inches to make it numeric
-        if key == "HT":
-            ft, inches = val.split("'")
-            inches = inches.replace('"', "")
-
-            val = 12 * int(ft) + int(inches)
-
-        gp_attributes[key] = float(val)
-
-    misc_attributes = dict()
-    for key in _PlayerMiscAttributes:
-        misc_attributes[key] = line[column_map[key]]
-
-    # deciper boosts..
-    boosts_str = misc_attributes["BOOST"]
-    player_boosts = []
-    if boosts_str != "None":
-        # boosts_str looks somethng like "ALL + 2 ZON -1 MAN"
-        boosts_str = boosts_str.split()
-        boost_team = boosts_str.pop(0)
-        player_boosts = []
-        while len(boosts_str):
-            boost_value = float(boosts_str.pop(0))
-            boost_attribute = boosts_str.pop(0)
-
-            this_boost = PlayerBoost(team=boost_team, attribute=boost_attribute,
-                                     value=boost_value)
-            player_boosts.append(this_boost)
-
-    player = Player(name=player_name, position=player_position, display_name=player_display_name,
-                    program=player_program, team=player_team, ovr=player_ovr, adjusted_ovr=player_adjusted_ovr, 
-                    type=player_type, boosts=player_boosts, auctionable=player_auctionable,
-                    date_added=player_date_added,
-                    gp_attributes=gp_attributes, misc_attributes=misc_attributes)
-
-    players.append(player)
-
-  return players
+  return column_map
+
+
+def _parse_height(val):
+  # convert height into inches to make it numeric
+  ft, inches = val.split("'")
+  inches = inches.replace('"', "")
+
+  return 12 * int(ft) + int(inches)
+
+
+def _parse_date(val):
+  return datetime.strptime(val, "%m/%d/%Y")
+
+
+def _parse_boosts(boosts_str):
+  """
+  List of PlayerBoost from boost column
+
+  """
+  player_boosts = []
+  if boosts_str != "None":
+    # boosts_str looks somethng like "ALL + 2 ZON -1 MAN"
+    boosts_str = boosts_str.split()
+    boost_team = boosts_str.pop(0)
+    while len(boosts_str):
+      boost_value = float(boosts_str.pop(0))
+      boost_attribute = boosts_str.pop(0)
+
+      this_boost = PlayerBoost(team=boost_team, attribute=boost_attribute,
+                               value=boost_value)
+      player_boosts.append(this_boost)
+
+  return player_boosts
+
+
+def normalize_name(name):
+  """
+  Normalized player name, as stored in Player.name
+
+  """
+  # just concat all parts of name, ignoring what is first & last and normalize case
+  return " ".join(name.split(', ')).lower()
+
+
+# what changed about a card between two database loads
+CardChange = namedtuple("CardChange", [ 'old', 'new', 'fields' ])
+
+
+def diff_databases(old_players, new_players):
+  """
+  DatabaseDiff of cards added, removed or changed between two database loads
+  (lists of players, PlayerColumns, etc), keyed by CARDID
+
+  """
+  old_cards = { player.misc_attributes['CARDID']: player for player in old_players }
+  new_cards = { player.misc_attributes['CARDID']: player for player in new_players }
+
+  added = { card_id: player for card_id, player in new_cards.items() if card_id not in old_cards }
+  removed = { card_id: player for card_id, player in old_cards.items() if card_id not in new_cards }
+
+  changed = dict()
+  for card_id, new_player in new_cards.items():
+    old_player = old_cards.get(card_id)
+    if old_player is None or old_player == new_player:
+      continue
+
+    fields = [ field for field in Player._fields if field not in ('gp_attributes', 'misc_attributes')
+               and getattr(old_player, field) != getattr(new_player, field) ]
+    fields += [ key for key in _PlayerGPAttributes if old_player.gp_attributes[key] != new_player.gp_attributes[key] ]
+    fields += [ key for key in _PlayerMiscAttributes
+                if old_player.misc_attributes[key] != new_player.misc_attributes[key] ]
+
+    changed[card_id] = CardChange(old=old_player, new=new_player, fields=fields)
+
+  return DatabaseDiff(added, removed, changed)
+
+
+class DatabaseDiff(object):
+  """
+  Cards added, removed & changed between two database loads (see diff_databases)
+
+  added & removed: dict of card id -> player
+  changed:  dict of card id -> CardChange of old & new player and list of changed
+            Player fields, gp attributes & misc attributes
+
+  positions, teams & names cover both old & new versions of every affected card,
+  for invalidating anything derived from them (see Standard.invalidate,
+  team_optimizer.util.refresh_preprocessed_database & affects_filter).
+
+  """
+
+  def __init__(self, added, removed, changed):
+    self.added = added
+    self.removed = removed
+    self.changed = changed
+
+  @property
+  def card_ids(self):
+    return set(self.added) | set(self.removed) | set(self.changed)
+
+  def players(self):
+    """
+    List of old & new versions of all affected cards
+
+    """
+    return (list(self.added.values()) + list(self.removed.values()) +
+            [ player for change in self.changed.values() for player in (change.old, change.new) ])
+
+  @property
+  def positions(self):
+    return set(player.position for player in self.players())
+
+  @property
+  def teams(self):
+    """
+    Teams of affected cards, plus teams any of their boosts apply to
+
+    """
+    players = self.players()
+    return set(player.team for player in players) | set(boost.team for player in players for boost in player.boosts)
+
+  @property
+  def names(self):
+    return set(player.name for player in self.players())
+
+  def affects_filter(self, auction_filter):
+    """
+    True if auction_filter's matches (and so match counts) may have changed
+
+    """
+    return any(auction_filter.matches(player) for player in self.players())
+
+  def __len__(self):
+    return len(self.added) + len(self.removed) + len(self.changed)
+
+  def __repr__(self):
+    return "{}({} added, {} removed, {} changed)".format(self.__class__.__name__, len(self.added),
+                                                        len(self.removed), len(self.changed))
+
+
+def player_database(player_db):
+  """
+  PlayerDatabase for list of players (or player_db itself if it already is one)
+
+  """
+  if isinstance(player_db, PlayerDatabase):
+    return player_db
+
+  return PlayerDatabase(player_db)
+
+
+def player_registry(player_db):
+  """
+  PlayerRegistry for list of players (or player_db itself if it already is one)
+
+  """
+  if isinstance(player_db, PlayerRegistry):
+    return player_db
+
+  return PlayerRegistry(player_db)
+
+
+class PlayerRegistry(object):
+  """
+  Players indexed by display name, normalized name & card id
+
+  Built once (eg from import_database_csv output) in place of scanning the
+  player list for each lookup.  Iterates over players in their original order.
+
+  """
+
+  def __init__(self, players):
+    self.players = list(players)
+
+    self.by_display_name = defaultdict(list)
+    self.by_name = defaultdict(list)
+    self.by_card_id = defaultdict(list)
+
+    for player in self.players:
+      self.by_display_name[player.display_name].append(player)
+      self.by_name[player.name].append(player)
+      self.by_card_id[player.misc_attributes['CARDID']].append(player)
+
+    self._order = { id(player): i for i, player in enumerate(self.players) }
+
+  def get(self, display_name):
+    """
+    Player with display name (must be exactly one)
+
+    """
+    return self._get_unique(self.by_display_name, display_name)
+
+  def get_card(self, card_id):
+    """
+    Player with card id (must be exactly one)
+
+    """
+    return self._get_unique(self.by_card_id, card_id)
+
+  def find_name(self, name):
+    """
+    List of players with name (normalized, so either filter name or Player.name)
+
+    """
+    return list(self.by_name.get(normalize_name(name), []))
+
+  def select(self, display_names):
+    """
+    Players with any of display_names, in original order
+
+    """
+    selected = [ player for display_name in set(display_names)
+                 for player in self.by_display_name.get(display_name, []) ]
+
+    return sorted(selected, key=lambda player: self._order[id(player)])
+
+  def duplicates(self):
+    """
+    dict of index (display_name, name or card_id) -> dict of key -> players
+    for keys shared by more than one player
+
+    """
+    duplicates = dict()
+    for index_name, index in [ ('display_name', self.by_display_name), ('name', self.by_name),
+                               ('card_id', self.by_card_id) ]:
+      duplicates[index_name] = { key: players for key, players in index.items() if len(players) > 1 }
+
+    return duplicates
+
+  def __iter__(self):
+    return iter(self.players)
+
+  def __len__(self):
+    return len(self.players)
+
+  def __repr__(self):
+    duplicates = self.duplicates()
+    return ("{}({} players, duplicates: {})".format(self.__class__.__name__, len(self),
+            ", ".join("{} {}".format(len(duplicates[k]), k) for k in [ 'display_name', 'name', 'card_id' ])))
+
+  def _get_unique(self, index, key):
+    players = index.get(key, [])
+    if len(players) == 0:
+      raise ValueError("Unknown player: {}".format(key))
+    elif len(players) > 1:
+      raise ValueError("Multiple players match: {}!".format(key))
+
+    return players[0]
+
+
+class PlayerDatabase(PlayerRegistry):
+  """
+  PlayerRegistry with secondary indexes on position, team, type, program &
+  auctionable, and players sorted by ovr & date added, for queries that don't
+  scan every player
+
+  """
+
+  _indexed_fields = [ 'position', 'team', 'type', 'program', 'auctionable' ]
+
+  def __init__(self, players):
+    PlayerRegistry.__init__(self, players)
+
+    self.indexes = { field: defaultdict(list) for field in self._indexed_fields }
+    for i, player in enumerate(self.players):
+      for field in self._indexed_fields:
+        self.indexes[field][getattr(player, field)].append(i)
+
+    self._ovr_order = sorted(range(len(self.players)), key=lambda i: self.players[i].ovr)
+    self._ovrs = [ self.players[i].ovr for i in self._ovr_order ]
+
+    self._date_order = sorted(range(len(self.players)), key=lambda i: self.players[i].date_added)
+    self._dates = [ self.players[i].date_added for i in self._date_order ]
+
+  def query(self, positions=None, teams=None, types=None, programs=None, auctionable=None,
+            min_ovr=None, max_ovr=None, min_date_added=None, max_date_added=None, name=None,
+            predicate=None):
+    """
+    List of players (in original order) matching all given criteria
+
+    positions, teams, types, programs: value or list of allowed values
+    auctionable:  "Yes" or "No"
+    min_ovr, max_ovr, min_date_added, max_date_added: inclusive limits
+    name:         substring of Player.name (like AuctionFilter)
+    predicate:    optional function of player, checked last
+
+    Indexed criteria are intersected starting with the fewest matches, then name &
+    predicate are checked on the remaining players.
+
+    """
+    matches = []
+    for field, values in [ ('position', positions), ('team', teams), ('type', types), ('program', programs),
+                           ('auctionable', auctionable) ]:
+      if values is None:
+        continue
+
+      if isinstance(values, six.string_types):
+        values = [ values ]
+
+      index = self.indexes[field]
+      matches.append(set(i for value in set(values) for i in index.get(value, [])))
+
+    for order, keys, min_key, max_key in [ (self._ovr_order, self._ovrs, min_ovr, max_ovr),
+                                           (self._date_order, self._dates, min_date_added, max_date_added) ]:
+      if min_key is None and max_key is None:
+        continue
+
+      start = 0 if min_key is None else bisect.bisect_left(keys, min_key)
+      end = len(keys) if max_key is None else bisect.bisect_right(keys, max_key)
+      matches.append(set(order[start:end]))
+
+    if len(matches) > 0:
+      matches = sorted(matches, key=len)
+      indices = sorted(matches[0].intersection(*matches[1:]))
+      players = [ self.players[i] for i in indices ]
+    else:
+      players = list(self.players)
+
+    if name is not None:
+      players = [ player for player in players if name in player.name ]
+
+    if predicate is not None:
+      players = [ player for player in players if predicate(player) ]
+
+    return players
+
+  def filter(self, auction_filter):
+    """
+    Players matching AuctionFilter (same as auction_filter.filter(players))
+
+    """
+    return self.query(auctionable="Yes", name=auction_filter.name, positions=auction_filter.positions,
+                      teams=auction_filter.teams, types=auction_filter.types, min_ovr=auction_filter.min_ovr,
+                      max_ovr=auction_filter.max_ovr)
+
+  def dates_added(self):
+    """
+    Sorted list of distinct dates players were added
+
+    """
+    return sorted(set(self._dates))
@@ -1,6 +1,7 @@
 from __future__ import division, print_function
 
 from . import candidates as mfc
+from ..database import player_database
 import copy
 from collections import namedtuple, Counter
 
@@ -13,6 +14,9 @@ def find_filters(targets, universe, min_name_len=1, max_name_len=5, num_filters=
 
     """
 
+    # indexed once here, since every candidate filter is applied to the whole universe
+    universe = player_database(universe)
+
     results = []
     for name_len in range(min_name_len, max_name_len + 1):
         candidate_name_filters = mfc.find_candidate_name_filters(targets,
@@ -29,7 +33,7 @@ def find_filters(targets, universe, min_name_len=1, max_name_len=5, num_filters=
             # number of names to search through (and since filtered universe is widest
             # possilbe universe to match from here on anyway)
             f = mfc.find_minimum_spanning_filter(targets, name_filter=name_filter)
-            filtered_universe = f.filter(universe)
+            filtered_universe = player_database(f.filter(universe))
 
             #res = iterate_one_step(f, targets, filtered_universe)
             res = optimize_filter(f, targets, filtered_universe, obj_func=obj_func)
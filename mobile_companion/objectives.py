@@ -0,0 +1,176 @@
+"""
+Declarative objectives for the team optimizers
+
+"""
+
+import six
+import numpy as np
+from .team import _team_positions, _team_positions_offense, _team_positions_defense, _team_positions_special
+from .calculators import MultiStandard
+
+# roster positions each team score averages over
+_sub_roster_positions = dict(overall=_team_positions, offense=_team_positions_offense,
+                             defense=_team_positions_defense, special=_team_positions_special)
+
+_stats = [ 'raw', 'rounded' ]
+
+
+class Objective(object):
+    """
+    Weighted sum of team scores, eg:
+
+        Objective(calc, "overall rounded")
+        Objective(calc, "0.6 offense raw + 0.4 defense raw")
+        Objective(calc, "overall rounded", tie_break="overall raw")
+
+    terms:      spec string like above, or list of (sub roster, stat, weight).  Stat
+                defaults to rounded in spec strings
+    tie_break:  optional terms added with weights scaled by tie_break_scale, so they
+                only separate teams with (nearly) equal terms
+    combine:    for MultiStandard calculators, how to combine across weight files
+                (default np.min, see MultiStandard.combined_score_func)
+
+    Objectives are called with a team like any obj_func, and optimizers use
+    batch_obj_func/evaluator_func for batch & incremental evaluation when they're
+    given an Objective (calculator's position cache is used by calling it directly).
+    position_weights gives each roster position's contribution.
+
+    """
+
+    def __init__(self, calculator, terms, tie_break=None, tie_break_scale=1e-6, combine=None):
+        self.calculator = calculator
+        self.terms = _parse_terms(terms)
+
+        if tie_break is not None:
+            self.tie_break_terms = _parse_terms(tie_break)
+        else:
+            self.tie_break_terms = []
+
+        self.tie_break_scale = tie_break_scale
+
+        if isinstance(calculator, MultiStandard):
+            if combine is None:
+                combine = np.min
+
+            self.score_func = calculator.combined_score_func(self._score_func, combine)
+            self.evaluator_func = None
+        else:
+            self.score_func = self._score_func
+            self.evaluator_func = self._evaluator_func
+
+    def __call__(self, team):
+        return self.score_func(self.calculator.score(team))
+
+    def batch_obj_func(self, teams):
+        """
+        Objective values of list of teams in one pass
+
+        """
+        return self.score_func(self.calculator.calculate_many(teams))
+
+    @property
+    def all_terms(self):
+        """
+        List of (sub roster, stat, weight) including (scaled) tie-break terms
+
+        """
+        return self.terms + [ (sub_roster, stat, weight * self.tie_break_scale)
+                              for sub_roster, stat, weight in self.tie_break_terms ]
+
+    @property
+    def monotone(self):
+        """
+        True if objective never decreases when a position score increases (so
+        calculators.UpperBounds screening is safe)
+
+        """
+        return all(weight >= 0 for sub_roster, stat, weight in self.all_terms)
+
+    def position_weights(self):
+        """
+        Objective weight of each roster position's raw & rounded score, ie objective
+        is sum of weight * position score (for one weight file)
+
+        """
+        weights = { roster_position: dict(raw=0.0, rounded=0.0) for roster_position in _team_positions }
+        for sub_roster, stat, weight in self.all_terms:
+            roster_positions = _sub_roster_positions[sub_roster]
+            for roster_position in roster_positions:
+                weights[roster_position][stat] += weight / len(roster_positions)
+
+        return weights
+
+    def sub_roster_weights(self):
+        """
+        Objective weight of each (sub roster, stat) team score
+
+        """
+        weights = dict()
+        for sub_roster, stat, weight in self.all_terms:
+            weights[(sub_roster, stat)] = weights.get((sub_roster, stat), 0.0) + weight
+
+        return weights
+
+    def __repr__(self):
+        spec = " + ".join(_format_term(term) for term in self.terms)
+        if len(self.tie_break_terms) > 0:
+            spec += ", tie-break " + " + ".join(_format_term(term) for term in self.tie_break_terms)
+
+        return "{}({})".format(self.__class__.__name__, spec)
+
+    def _score_func(self, team_attributes):
+        obj = 0.0
+        for sub_roster, stat, weight in self.all_terms:
+            obj = obj + weight * team_attributes[sub_roster][stat]
+
+        return obj
+
+    def _evaluator_func(self, team):
+        return self.calculator.evaluator(team, self.score_func)
+
+
+def _parse_terms(terms):
+    """
+    List of (sub roster, stat, weight) from spec string or list of terms
+
+    """
+    if isinstance(terms, six.string_types):
+        parsed_terms = []
+        for term in terms.split('+'):
+            tokens = term.replace('*', ' ').split()
+
+            try:
+                weight = float(tokens[0])
+                tokens = tokens[1:]
+            except (IndexError, ValueError):
+                weight = 1.0
+
+            if len(tokens) == 1:
+                tokens.append('rounded')
+
+            if len(tokens) != 2:
+                raise ValueError("Can't parse objective term: '{}'".format(term.strip()))
+
+            parsed_terms.append((tokens[0], tokens[1], weight))
+
+        terms = parsed_terms
+
+    terms = [ (sub_roster, stat, float(weight)) for sub_roster, stat, weight in terms ]
+
+    for sub_roster, stat, weight in terms:
+        if sub_roster not in _sub_roster_positions:
+            raise ValueError("Unknown team score: {}.  Allowable team scores "
+                             "are: {}".format(sub_roster, sorted(_sub_roster_positions.keys())))
+
+        if stat not in _stats:
+            raise ValueError("Unknown score type: {}.  Allowable types are: {}".format(stat, _stats))
+
+    return terms
+
+
+def _format_term(term):
+    sub_roster, stat, weight = term
+    if weight == 1.0:
+        return "{} {}".format(sub_roster, stat)
+
+    return "{:g} {} {}".format(weight, sub_roster, stat)
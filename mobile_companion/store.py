@@ -0,0 +1,178 @@
+"""
+Read-only player store shared by worker processes
+
+The store's arrays are written once as .npy files to a directory in shared memory
+(/dev/shm when there is one) and processes attach to it by name with memory mapped,
+read-only arrays.  So a pool of N workers uses one copy of the database, and
+passing a store to a worker only pickles its name.
+
+Files in shared memory outlive processes, so the creating process should unlink
+the store when done (eg by using it as a context manager).  Stores it hasn't
+unlinked are removed when it exits.
+
+(multiprocessing.shared_memory needs python 3.8, this works with python 2 too)
+
+"""
+
+import atexit, os, shutil, tempfile
+import numpy as np
+from .core import _PlayerGPAttributes
+from .team import _allowable_player_positions, _team_positions
+from .database import (players_to_columns, write_columns, read_columns, read_columns_meta, read_column_array,
+                       _parse_boosts, _as_str)
+
+if os.path.isdir('/dev/shm'):
+    _shared_dir = '/dev/shm'
+else:
+    _shared_dir = tempfile.gettempdir()
+
+_store_prefix = 'mobile_companion_store_'
+
+# directory -> pid of process that created it, for stores not yet unlinked
+_created_stores = dict()
+
+
+def create_store(player_db, name=None):
+    """
+    Write player_db (list of players or database.PlayerColumns) to a new shared
+    store and attach to it
+
+    name:   store name (default is a new unique name), see attach_store
+
+    """
+    player_columns = players_to_columns(player_db)
+
+    if name is None:
+        store_dir = tempfile.mkdtemp(prefix=_store_prefix, dir=_shared_dir)
+    else:
+        store_dir = _store_dir(name)
+        os.makedirs(store_dir)
+
+    try:
+        # boost tables: one row per boost, teams coded by boost_teams & attributes
+        # by _PlayerGPAttributes (-1 if unknown)
+        boost_strs, boost_codes = np.unique([ _as_str(boost_str)
+                                              for boost_str in player_columns.misc_attributes['BOOST'] ],
+                                            return_inverse=True)
+        parsed_boosts = [ _parse_boosts(boost_str) for boost_str in boost_strs ]
+        boosts = [ (iplayer, boost) for iplayer, code in enumerate(boost_codes) for boost in parsed_boosts[code] ]
+        boost_teams = sorted(set(boost.team for iplayer, boost in boosts))
+        boost_team_index = { team: i for i, team in enumerate(boost_teams) }
+
+        attribute_index = { key: i for i, key in enumerate(_PlayerGPAttributes) }
+        arrays = dict(boost_player=np.array([ iplayer for iplayer, boost in boosts ], dtype=np.int32),
+                      boost_team=np.array([ boost_team_index[boost.team] for iplayer, boost in boosts ],
+                                          dtype=np.int32),
+                      boost_attribute=np.array([ attribute_index.get(boost.attribute, -1)
+                                                 for iplayer, boost in boosts ], dtype=np.int32),
+                      boost_value=np.array([ boost.value for iplayer, boost in boosts ], dtype=float))
+
+        # players eligible for each roster position (in _team_positions order)
+        arrays['eligible'] = np.array([ player_columns.isin('POS', _allowable_player_positions[roster_position])
+                                        for roster_position in _team_positions ], dtype=bool)
+
+        write_columns(player_columns, store_dir, arrays=arrays, boost_teams=boost_teams,
+                      roster_positions=_team_positions)
+    except Exception:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        raise
+
+    _created_stores[store_dir] = os.getpid()
+
+    return SharedPlayerStore(store_dir)
+
+
+def attach_store(name):
+    """
+    Attach to existing shared store (by SharedPlayerStore.name)
+
+    """
+    return SharedPlayerStore(_store_dir(name))
+
+
+class SharedPlayerStore(object):
+    """
+    Player database in shared memory (see create_store & attach_store)
+
+    columns:    database.PlayerColumns with memory mapped arrays (so indexing
+                gives compact players backed by the shared arrays)
+    boost_player, boost_team, boost_attribute, boost_value: boost tables
+                (boost_team indexes boost_teams, boost_attribute _PlayerGPAttributes)
+    eligible:   bool array of roster position (in roster_positions order) x player
+
+    The process that created the store should unlink it when all are done, or
+    use it as a context manager:
+
+        with store.create_store(players) as player_store:
+            ...
+
+    """
+
+    def __init__(self, store_dir):
+        meta = read_columns_meta(store_dir)
+        if meta is None or 'roster_positions' not in meta:
+            raise ValueError("No player store: {}".format(store_dir))
+
+        self.name = os.path.basename(store_dir)
+        self._store_dir = store_dir
+
+        self.columns = read_columns(store_dir, meta)
+        self.boost_teams = [ _as_str(team) for team in meta['boost_teams'] ]
+        self.roster_positions = [ _as_str(roster_position) for roster_position in meta['roster_positions'] ]
+
+        for array_name in [ 'boost_player', 'boost_team', 'boost_attribute', 'boost_value', 'eligible' ]:
+            setattr(self, array_name, read_column_array(store_dir, array_name))
+
+    def eligible_players(self, roster_position):
+        """
+        Indices of players eligible for roster_position
+
+        """
+        return np.flatnonzero(self.eligible[self.roster_positions.index(roster_position)])
+
+    def players(self, indices=None):
+        return self.columns.players(indices)
+
+    def unlink(self):
+        """
+        Remove the store (processes still attached keep their mapped arrays)
+
+        """
+        shutil.rmtree(self._store_dir, ignore_errors=True)
+        _created_stores.pop(self._store_dir, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
+
+    def __reduce__(self):
+        # workers attach by name rather than getting a copy
+        return (attach_store, (self.name,))
+
+    def __getitem__(self, i):
+        return self.columns[i]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __repr__(self):
+        return "{}({}, {} players)".format(self.__class__.__name__, self.name, len(self))
+
+
+def _store_dir(name):
+    return os.path.join(_shared_dir, name)
+
+
+def _unlink_created_stores():
+    # forked children exiting normally run this too, but only remove their own stores
+    for store_dir, pid in list(_created_stores.items()):
+        if pid == os.getpid():
+            shutil.rmtree(store_dir, ignore_errors=True)
+            del _created_stores[store_dir]
+
+atexit.register(_unlink_created_stores)
@@ -2,7 +2,13 @@
 Structure for storing teams
 
 """
-import os
+import os, six
+from .database import player_registry
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 # mapping of roster positions to allowable players
 _allowable_player_positions = dict(C=['C'], FB=['HB', 'FB'], HB=['HB'],
@@ -31,14 +37,133 @@ _team_positions_special = ['K', 'KR', 'P', 'PR']
 _team_positions = (_team_positions_offense + _team_positions_defense +
                    _team_positions_special)
 
+# index of each roster position in compact rosters
+_team_position_index = { pos: i for i, pos in enumerate(_team_positions) }
+
+
+class Roster(MutableMapping):
+    """
+    dict-like view of a team's roster (roster position -> player), in
+    _team_positions order
+
+    """
+    __slots__ = ('_team',)
+
+    def __init__(self, team):
+        self._team = team
+
+    def __getitem__(self, roster_position):
+        player = self._team._players[_team_position_index[roster_position]]
+        if player is None:
+            raise KeyError(roster_position)
+
+        return player
+
+    def __setitem__(self, roster_position, player):
+        self._team._put(roster_position, player)
+
+    def __delitem__(self, roster_position):
+        if roster_position not in self:
+            raise KeyError(roster_position)
+
+        self._team._put(roster_position, None)
+
+    def __contains__(self, roster_position):
+        islot = _team_position_index.get(roster_position)
+        return islot is not None and self._team._players[islot] is not None
+
+    def __iter__(self):
+        players = self._team._players
+        return iter([ pos for pos, player in zip(_team_positions, players) if player is not None ])
+
+    def __len__(self):
+        return len(self._team._players) - self._team._players.count(None)
+
+    # faster than going through __getitem__ for each roster position
+    def items(self):
+        return [ (pos, player) for pos, player in zip(_team_positions, self._team._players) if player is not None ]
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [ player for player in self._team._players if player is not None ]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def iterkeys(self):
+        return iter(self)
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class Team(object):
     """
     Roster of players
+
+    Stored compactly as list of players (one per roster position, in
+    _team_positions order, None if empty) plus counts of player names on the
+    roster, so copying is cheap and contains() doesn't search the roster.  roster
+    is a dict-like view of it.  Players are never modified, so copies (including
+    deep copies) of a team share the same players.
     """
 
     def __init__(self, name=None):
         self.name = name
-        self.roster = dict()
+        self._players = [ None ] * len(_team_positions)
+        self._names = dict()
+
+    @property
+    def roster(self):
+        return Roster(self)
+
+    @roster.setter
+    def roster(self, roster):
+        roster = dict(roster)
+
+        self._players = [ None ] * len(_team_positions)
+        self._names = dict()
+        for roster_position, player in six.iteritems(roster):
+            self._put(roster_position, player)
+
+    @property
+    def key(self):
+        """
+        Hashable key of roster (same for teams with the same players in the same
+        roster positions), made of player ids so only valid while its players are
+        alive (ids can be reused after that)
+
+        """
+        return tuple(map(id, self._players))
+
+    def copy(self):
+        """
+        Copy of team (sharing players)
+
+        """
+        other = Team.__new__(Team)
+        other.name = self.name
+        other._players = self._players[:]
+        other._names = self._names.copy()
+
+        return other
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __getstate__(self):
+        return dict(name=self.name, roster=dict(self.roster))
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.roster = state['roster']
 
     def set_position(self, roster_position, player):
         allowable_positions = _allowable_player_positions[roster_position]
@@ -51,26 +176,37 @@ class Team(object):
         if self.contains(player, exclude_position=roster_position):
             raise ValueError("{} is already on roster".format(player.display_name))
 
-        self.roster[roster_position] = player
+        self._put(roster_position, player)
 
     def contains(self, player, exclude_position=None):
         """
         Check if a player is already on a team
         """
+        count = self._names.get(player.name, 0)
 
-        if exclude_position is None:
-            res = player.name in [ p.name for p in self.roster.values() ]
-        else:
-            res = False
-            for k, v in self.roster.iteritems():
-                if k != exclude_position:
-                    if v.name == player.name:
-                        res = True
-                        break
+        if count > 0 and exclude_position is not None:
+            other = self._players[_team_position_index[exclude_position]]
+            if other is not None and other.name == player.name:
+                count -= 1
 
-        return res
+        return count > 0
 
-        
+    def _put(self, roster_position, player):
+        """
+        Put player (or None to empty) in roster position, without any checks
+
+        """
+        islot = _team_position_index[roster_position]
+
+        other = self._players[islot]
+        if other is not None:
+            self._names[other.name] -= 1
+            if self._names[other.name] == 0:
+                del self._names[other.name]
+
+        self._players[islot] = player
+        if player is not None:
+            self._names[player.name] = self._names.get(player.name, 0) + 1
 
     @property
     def offense(self):
@@ -110,11 +246,15 @@ class Team(object):
     def load(team_file, player_db):
         """
         Load existing team from file
+
+        player_db is list of players or database.PlayerRegistry (faster when loading
+        many teams)
         """
 
         if not os.path.exists(team_file):
             raise IOError("Team file not found: {}".format(team_file))
 
+        registry = player_registry(player_db)
         team = Team()
 
         with open(team_file, 'r') as f:
@@ -123,17 +263,9 @@ class Team(object):
                     continue
 
                 pos, player_name = line.strip().split('|')
-                print(player_name)
 
                 # look up player name in database...
-                matched_player = [ p for p in player_db if p.display_name == player_name ]
-                if len(matched_player) == 0:
-                    raise ValueError("Unknown player: {}".format(player_name))
-                elif len(matched_player) > 1:
-                    raise ValueError("Multiple players match: {}!".format(player_name))
-                else:
-                    matched_player = matched_player[0]
-                    team.set_position(pos, matched_player)
+                team.set_position(pos, registry.get(player_name))
 
         # make sure all positions were filled...
         missing_positions = [ pos for pos in _team_positions if pos not in team.roster ]
@@ -141,3 +273,31 @@ class Team(object):
             raise ValueError("Following position(s) are missing: {}".format(missing_positions))
 
         return team
+
+    @staticmethod
+    def load_many(team_files, player_db):
+        """
+        Load & validate many team files (or all files in a directory) at once
+
+        Returns dict of team file -> Team.  Every file is checked before raising
+        ValueError listing all files that failed to load
+        """
+        if isinstance(team_files, six.string_types):
+            team_files = sorted(os.path.join(team_files, f) for f in os.listdir(team_files)
+                                if os.path.isfile(os.path.join(team_files, f)))
+
+        registry = player_registry(player_db)
+
+        teams = dict()
+        errors = []
+        for team_file in team_files:
+            try:
+                teams[team_file] = Team.load(team_file, registry)
+            except (IOError, ValueError) as e:
+                errors.append("{}: {}".format(team_file, e))
+
+        if len(errors) > 0:
+            raise ValueError("{} of {} team files failed to load:\n{}".format(len(errors), len(team_files),
+                                                                              "\n".join(errors)))
+
+        return teams
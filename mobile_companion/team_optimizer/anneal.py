@@ -1,11 +1,31 @@
-import random, math, copy
+import random, math
 from ..team import _allowable_player_positions
 import util as _opt_util
 
 def optimize(team, players, obj_func, T_min=.0001, T_alpha=.9995, T=1.0,
-             candidate_roster_positions=None, constrained_players=None, verbose=False):
+             candidate_roster_positions=None, constrained_players=None, evaluator_func=None,
+             upper_bounds=None, verbose=False):
+    """
+    Simulated annealing of team
+
+    obj_func: function of team, or objectives.Objective (whose evaluator is used
+              if evaluator_func isn't given)
+    evaluator_func: optional function creating an incremental evaluator for a team
+                    (eg, lambda team: calc.evaluator(team, score_func)), used instead
+                    of obj_func to score each step
+    upper_bounds: optional calculators.UpperBounds for players, used (with evaluator_func)
+                  to reject steps that can't be accepted without scoring them.  Steps
+                  taken are the same as without it
+
+    """
+
+    player_db = _opt_util.candidate_pools(players, constrained_players=constrained_players)
 
-    player_db = _opt_util.pre_process_database(players, constrained_players=constrained_players)
+    evaluator_func = _opt_util.objective_hooks(obj_func, evaluator_func=evaluator_func)[1]
+    if evaluator_func is not None:
+        evaluator = evaluator_func(team)
+    else:
+        evaluator = None
 
     if candidate_roster_positions is None:
         candidate_roster_positions = team.roster.keys()
@@ -20,16 +40,60 @@ def optimize(team, players, obj_func, T_min=.0001, T_alpha=.9995, T=1.0,
     additional_runs = [ 0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 4, 5, 6, 7, 8]
 
     while T > T_min:
-        current_obj = obj_func(team)
+        if evaluator is not None and upper_bounds is not None:
+            current_obj = evaluator.objective
+
+            new_team = evaluator.team.copy()
+            moves = [ _random_move(new_team, player_db, candidate_roster_positions) ]
+            new_team.set_position(*moves[-1])
+
+            # allow multiple moves occaisonaly
+            for i in range(random.choice(additional_runs)):
+                moves.append(_random_move(new_team, player_db, candidate_roster_positions))
+                new_team.set_position(*moves[-1])
+
+            # acceptance is decided by the same random draw as below
+            acceptance_draw = random.random()
+            obj_bound = evaluator.bound_moves(moves, upper_bounds)
+
+            if obj_bound <= current_obj and acceptance_draw >= math.exp((obj_bound - current_obj) / T):
+                upper_bounds.num_screened += 1
+                iter += 1
+                T = T * T_alpha
+                continue
 
-        new_team = _random_step(team, player_db, candidate_roster_positions)
+            upper_bounds.num_evaluated += 1
 
-        # allow multiple moves occaisonaly
-        for i in range(random.choice(additional_runs)):
-            new_team = _random_step(new_team, player_db, candidate_roster_positions)
+            new_evaluator = evaluator.copy()
+            for move in moves:
+                new_evaluator.swap(*move)
 
+            new_team = new_evaluator.team
+            new_obj = new_evaluator.objective
+        elif evaluator is not None:
+            current_obj = evaluator.objective
+
+            # only the swapped players are rescored
+            new_evaluator = evaluator.copy()
+            new_evaluator.swap(*_random_move(new_evaluator.team, player_db, candidate_roster_positions))
+
+            # allow multiple moves occaisonaly
+            for i in range(random.choice(additional_runs)):
+                new_evaluator.swap(*_random_move(new_evaluator.team, player_db, candidate_roster_positions))
+
+            new_team = new_evaluator.team
+            new_obj = new_evaluator.objective
+        else:
+            current_obj = obj_func(team)
+
+            new_team = _random_step(team, player_db, candidate_roster_positions)
+
+            # allow multiple moves occaisonaly
+            for i in range(random.choice(additional_runs)):
+                new_team = _random_step(new_team, player_db, candidate_roster_positions)
+
+            new_obj = obj_func(new_team)
 
-        new_obj = obj_func(new_team)
         obj_improvement = new_obj - current_obj
 
         if obj_improvement > 0:
@@ -46,8 +110,13 @@ def optimize(team, players, obj_func, T_min=.0001, T_alpha=.9995, T=1.0,
             #print("Acceptance prob = {}".format(acceptance_prob))
             pass
 
-        if random.random() < acceptance_prob:
+        if upper_bounds is None or evaluator is None:
+            acceptance_draw = random.random()
+
+        if acceptance_draw < acceptance_prob:
             team = new_team
+            if evaluator is not None:
+                evaluator = new_evaluator
 
             if new_obj > best_obj:
                 best_obj = new_obj
@@ -56,6 +125,9 @@ def optimize(team, players, obj_func, T_min=.0001, T_alpha=.9995, T=1.0,
         iter += 1
         T = T * T_alpha
 
+    if verbose and upper_bounds is not None:
+        print(upper_bounds)
+
     return best_team
 
 def _random_step(team, player_db, candidate_roster_positions=None, verbose=False, debug=False):
@@ -65,8 +137,22 @@ def _random_step(team, player_db, candidate_roster_positions=None, verbose=False
     candidate_roster_position is list of roster positions that we are allowed to change
     
     """
-    team = copy.deepcopy(team)
+    team = team.copy()
+
+    roster_position, swap_player = _random_move(team, player_db, candidate_roster_positions)
+
+    if verbose:
+        print("replacing {} with {}".format(team.roster[roster_position], swap_player))
+
+    team.set_position(roster_position, swap_player)
+
+    return team
+
+def _random_move(team, player_db, candidate_roster_positions=None):
+    """
+    Pick random (roster position, player) swap for team
 
+    """
     if candidate_roster_positions is None:
         candidate_roster_positions = team.roster.keys()
 
@@ -84,9 +170,4 @@ def _random_step(team, player_db, candidate_roster_positions=None, verbose=False
     # and pick random player 
     swap_player = random.choice(possible_players_to_add)
 
-    if verbose:
-        print("replacing {} with {}".format(team.roster[roster_position], swap_player))
-
-    team.set_position(roster_position, swap_player)
-
-    return team
\ No newline at end of file
+    return roster_position, swap_player
\ No newline at end of file
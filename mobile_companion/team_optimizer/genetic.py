@@ -2,42 +2,76 @@ from ..team import Team, _allowable_player_positions, _team_positions
 import util as _opt_util
 import random, copy
 
+# populations smaller than this are always scored in this process
+_min_parallel_population = 100
+
 def optimize(population_size, players, obj_func, num_evolutions=1000, include_individuals=None, 
-             constrained_players=None, verbose=False):
+             constrained_players=None, batch_obj_func=None, verbose=False, workers=None, seed=None):
+    """
+    Genetic optimization
+
+    workers: if more than 1, each generation is scored by a pool of this many
+             worker processes (see util.ObjectivePool), unless population_size is
+             under _min_parallel_population.  Results are the same for any
+             number of workers
+    seed: if not None, random is seeded with it first
+
+    """
+    if seed is not None:
+        random.seed(seed)
 
     if constrained_players is None:
         constraned_players = {}
 
-    preprocessed_player_db = _opt_util.pre_process_database(players, constrained_players=constrained_players)
+    batch_obj_func = _opt_util.objective_hooks(obj_func, batch_obj_func=batch_obj_func)[0]
 
-    if include_individuals is not None:
-        population = copy.deepcopy(include_individuals)
-        population.extend(create_population(preprocessed_player_db, population_size - len(include_individuals)))
-    else:
-        population = create_population(preprocessed_player_db, population_size)
+    preprocessed_player_db = _opt_util.candidate_pools(players, constrained_players=constrained_players)
 
-    obj_values = [ obj_func(t) for t in population ]
-    mean_obj = _mean(obj_values)
-    max_obj = max(obj_values)
-    prior_max = max_obj
-    
-    if verbose:
-        print("initial population: mean={:.2f}, max={:.2f}".format(mean_obj, max_obj))
+    worker_pool = None
+    if workers is not None and workers > 1 and population_size >= _min_parallel_population:
+        # every player individuals can be made of
+        pool_players = dict((id(p), p) for pool in preprocessed_player_db.values() for p in pool)
+        for individual in include_individuals or []:
+            pool_players.update((id(p), p) for p in individual.roster.values())
+
+        worker_pool = _opt_util.ObjectivePool(obj_func, list(pool_players.values()), workers,
+                                              batch_obj_func=batch_obj_func)
+        batch_obj_func = worker_pool.batch_obj_func
 
-    for istep in range(num_evolutions):
-        population = evolve_one_step(population, preprocessed_player_db, obj_func)
+    try:
+        if include_individuals is not None:
+            population = copy.deepcopy(include_individuals)
+            population.extend(create_population(preprocessed_player_db, population_size - len(include_individuals)))
+        else:
+            population = create_population(preprocessed_player_db, population_size)
 
-        obj_values = [ obj_func(t) for t in population ]
+        obj_values = _opt_util.evaluate_many(population, obj_func, batch_obj_func=batch_obj_func)
         mean_obj = _mean(obj_values)
         max_obj = max(obj_values)
-        
+        prior_max = max_obj
+    
         if verbose:
-            print("iteration[{}]: population: mean={:.2f}, max={:.2f}".format(istep, mean_obj, max_obj))
+            print("initial population: mean={:.2f}, max={:.2f}".format(mean_obj, max_obj))
 
-        prior_max = max_obj
-        old_population = population
+        for istep in range(num_evolutions):
+            population = evolve_one_step(population, preprocessed_player_db, obj_func,
+                                         batch_obj_func=batch_obj_func, obj_values=obj_values)
 
-    best_res = max(population, key=obj_func)
+            obj_values = _opt_util.evaluate_many(population, obj_func, batch_obj_func=batch_obj_func)
+            mean_obj = _mean(obj_values)
+            max_obj = max(obj_values)
+        
+            if verbose:
+                print("iteration[{}]: population: mean={:.2f}, max={:.2f}".format(istep, mean_obj, max_obj))
+
+            prior_max = max_obj
+            old_population = population
+    finally:
+        if worker_pool is not None:
+            worker_pool.close()
+
+    # obj_values are already up to date with population
+    best_res = population[obj_values.index(max(obj_values))]
 
     misc_res = dict()
     misc_res['population'] = population
@@ -159,7 +193,7 @@ def combine_individuals(mother, father, verbose=False):
 def mutate_individual(team, player_db, mutation_probability=.5, mutation_rate=.1, verbose=False):
     
     if random.random() < mutation_probability:
-        team = copy.deepcopy(team)
+        team = team.copy()
 
         if verbose:
             print("Mutating!!")
@@ -180,12 +214,16 @@ def mutate_individual(team, player_db, mutation_probability=.5, mutation_rate=.1
 
 
 def evolve_one_step(population, player_db, obj_func, mutation_probabiliy=.5, mutation_rate=.1,
-                    keep_top_pct=.2, mutate_pct=.5, verbose=False):
+                    keep_top_pct=.2, mutate_pct=.5, batch_obj_func=None, obj_values=None, verbose=False):
     """
     Evolve population one step
 
+    batch_obj_func: optional function to score whole population in one call
+    obj_values: objective values of population, if already known
+
     """
-    obj_values = [ obj_func(team) for team in population ]
+    if obj_values is None:
+        obj_values = _opt_util.evaluate_many(population, obj_func, batch_obj_func=batch_obj_func)
 
     keep_top_count = int(len(population) * keep_top_pct)
     mutate_count = int(len(population) * mutate_pct)
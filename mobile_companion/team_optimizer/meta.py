@@ -5,15 +5,47 @@ An attempt at using results from different optimizer to find an overall better r
 
 """
 import genetic as TOG
+import vector_genetic as TOV
 import myopic as TOM
 import anneal as TOA
-import copy
+import util as _opt_util
+import copy, random
 
-def optimize(players, obj_func, initial_guess=None, verbose=False, constrained_players=None):
+def optimize(players, obj_func, initial_guess=None, verbose=False, constrained_players=None,
+             batch_obj_func=None, evaluator_func=None, upper_bounds=None, cache_size=100000, vectorized=False):
     """
     Meta optimization using various underlying optimizers
+
+    obj_func: function of team, or objectives.Objective (used for batch &
+              incremental evaluation by the underlying optimizers)
+    batch_obj_func: optional function scoring a list of teams in one call, passed
+                    on to genetic & myopic optimizers
+    evaluator_func: optional function creating an incremental evaluator for a team,
+                    passed on to anneal & myopic optimizers
+    upper_bounds: optional calculators.UpperBounds for players, passed on to anneal &
+                  myopic optimizers to screen swaps
+    cache_size: objective values of up to this many rosters are cached and shared by
+                all the underlying optimizers (None to disable).  Hit rates are
+                reported at the end if verbose
+    vectorized: if True, the genetic passes use vector_genetic with populations of
+                500 & 2000 in place of 5 & 50 (obj_func must be an
+                objectives.Objective)
+
+    players can also be util.CandidatePools (eg from util.candidate_pools), which
+    are otherwise made once here and shared by all the underlying optimizers (score
+    aware pools when obj_func is an objective they're safe for, see
+    util.pool_calculator)
     """
     
+    players = _opt_util.candidate_pools(players, constrained_players=constrained_players,
+                                        calculator=_opt_util.pool_calculator(obj_func))
+
+    if cache_size is not None:
+        obj_func = _opt_util.CachedObjective(obj_func, batch_obj_func=batch_obj_func,
+                                             evaluator_func=evaluator_func, maxsize=cache_size)
+        batch_obj_func = obj_func.batch_obj_func
+        evaluator_func = obj_func.evaluator_func
+
     # we'll include various intermediate results in final GP for better diversity
     teams_to_include = []
 
@@ -22,8 +54,14 @@ def optimize(players, obj_func, initial_guess=None, verbose=False, constrained_p
 
 
     # first try a small genetic opt to get a reasonable starting point
-    best_team, res = TOG.optimize(5, players, obj_func=obj_func, num_evolutions=100, 
-                                  constrained_players=constrained_players, include_individuals=teams_to_include)
+    if vectorized:
+        best_team, res = TOV.optimize(500, players, obj_func, num_evolutions=20,
+                                      constrained_players=constrained_players, include_individuals=teams_to_include,
+                                      seed=random.getrandbits(32))
+    else:
+        best_team, res = TOG.optimize(5, players, obj_func=obj_func, num_evolutions=100, 
+                                      constrained_players=constrained_players, include_individuals=teams_to_include,
+                                      batch_obj_func=batch_obj_func)
     teams_to_include.append(copy.deepcopy(best_team))
     best_obj = obj_func(best_team)
 
@@ -31,7 +69,8 @@ def optimize(players, obj_func, initial_guess=None, verbose=False, constrained_p
         print("Results from initial genetic opt: {}".format(best_obj))
     
     # now anneal that badboy
-    best_team = TOA.optimize(best_team, players, obj_func=obj_func, constrained_players=constrained_players)
+    best_team = TOA.optimize(best_team, players, obj_func=obj_func, constrained_players=constrained_players,
+                             evaluator_func=evaluator_func, upper_bounds=upper_bounds)
     teams_to_include.append(copy.deepcopy(best_team))
     best_obj = obj_func(best_team)
     
@@ -39,23 +78,94 @@ def optimize(players, obj_func, initial_guess=None, verbose=False, constrained_p
         print("Results after annealing: {}".format(best_obj))
 
     # myopic too...
-    best_team = TOM.optimize(best_team, players, obj_func=obj_func, constrained_players=constrained_players) 
+    best_team = TOM.optimize(best_team, players, obj_func=obj_func, constrained_players=constrained_players,
+                             batch_obj_func=batch_obj_func, evaluator_func=evaluator_func,
+                             upper_bounds=upper_bounds)
     teams_to_include.append(copy.deepcopy(best_team))
     best_obj = obj_func(best_team)
     
     # include in large scale GP
-    best_team, res = TOG.optimize(50, players, obj_func=obj_func, include_individuals=teams_to_include,
-                                 constrained_players=constrained_players)
+    if vectorized:
+        best_team, res = TOV.optimize(2000, players, obj_func, num_evolutions=50, include_individuals=teams_to_include,
+                                      constrained_players=constrained_players, seed=random.getrandbits(32))
+    else:
+        best_team, res = TOG.optimize(50, players, obj_func=obj_func, include_individuals=teams_to_include,
+                                     constrained_players=constrained_players, batch_obj_func=batch_obj_func)
     best_obj = obj_func(best_team)
 
     if verbose:
         print("Results after 2nd pass genetic opt: {}".format(best_obj))
 
     # and final myopic
-    best_team = TOM.optimize(best_team, players, obj_func=obj_func, constrained_players=constrained_players) 
+    best_team = TOM.optimize(best_team, players, obj_func=obj_func, constrained_players=constrained_players,
+                             batch_obj_func=batch_obj_func, evaluator_func=evaluator_func,
+                             upper_bounds=upper_bounds)
     best_obj = obj_func(best_team)
 
     if verbose:
         print("Final result: {}".format(best_obj))
 
-    return best_team, best_obj
\ No newline at end of file
+        if cache_size is not None:
+            print("Objective cache: {}".format(obj_func.cache))
+
+    return best_team, best_obj
+
+def reoptimize(team, players, new_players, obj_func, constrained_players=None, batch_obj_func=None,
+               evaluator_func=None, upper_bounds=None, verbose=False):
+    """
+    Update team (eg the best team before new_players were added) for players, which
+    now include new_players
+
+    New players can't improve team with a swap if they aren't candidates (see
+    util.candidate_pools), or have no boosts and an upper bound position score (see
+    calculators.UpperBounds) no higher than team's score at each roster position
+    they could fill.  If that goes for all of them team is kept as is, otherwise only
+    the roster positions the rest could fill are re-optimized (myopic), followed by a
+    myopic pass over the whole roster if team changed.  Upper bounds need a
+    monotone objectives.Objective (see util.pool_calculator), or every new candidate
+    counts.  They (or upper_bounds, if given) are only used for that check, so
+    myopic keeps its batched swap scoring.
+
+    Returns (team, objective value, list of re-optimized roster positions)
+
+    """
+    calculator = _opt_util.pool_calculator(obj_func)
+    players = _opt_util.candidate_pools(players, constrained_players=constrained_players, calculator=calculator)
+    pool_players = dict((roster_position, set(id(p) for p in pool)) for roster_position, pool in players.items())
+
+    if calculator is not None:
+        if upper_bounds is None:
+            # pools keep every boosted player, so bounds are the same as for all players
+            unique_players = dict((id(p), p) for pool in players.values() for p in pool)
+            upper_bounds = calculator.upper_bounds(list(unique_players.values()))
+
+        team_scores = calculator.position_scores(team)
+
+    roster_positions = set()
+    for player in new_players:
+        for roster_position, pool in pool_players.items():
+            if id(player) not in pool:
+                continue
+
+            if (calculator is None or len(calculator._compile_player(player).boosts) > 0 or
+                    upper_bounds.get(player)[0] > team_scores[roster_position][0]):
+                roster_positions.add(roster_position)
+
+    roster_positions = sorted(roster_positions)
+    if len(roster_positions) == 0:
+        if verbose:
+            print("No new player can improve team")
+
+        return team, obj_func(team), roster_positions
+
+    if verbose:
+        print("Re-optimizing {}".format(", ".join(roster_positions)))
+
+    best_team = TOM.optimize(team, players, obj_func=obj_func, candidate_roster_positions=roster_positions,
+                             batch_obj_func=batch_obj_func, evaluator_func=evaluator_func)
+
+    if best_team.key != team.key:
+        best_team = TOM.optimize(best_team, players, obj_func=obj_func, batch_obj_func=batch_obj_func,
+                                 evaluator_func=evaluator_func)
+
+    return best_team, obj_func(best_team), roster_positions
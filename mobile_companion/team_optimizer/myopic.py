@@ -1,12 +1,32 @@
-import copy
 from ..team import _allowable_player_positions
 import util as _opt_util
 
 
-def optimize(team, players, obj_func, constrained_players=None, candidate_roster_positions=None, verbose=False):
-    new_team = copy.deepcopy(team)
+def optimize(team, players, obj_func, constrained_players=None, candidate_roster_positions=None,
+             batch_obj_func=None, evaluator_func=None, upper_bounds=None, verbose=False):
+    """
+    Repeatedly take the single best swap until no swap improves the objective
+
+    obj_func: function of team, or objectives.Objective (whose batch & incremental
+              evaluation is used if batch_obj_func/evaluator_func aren't given)
+    batch_obj_func: optional function to score all swaps at a roster position in one call
+    evaluator_func: optional function creating an incremental evaluator for a team
+                    (eg, lambda team: calc.evaluator(team, score_func)), used instead
+                    of obj_func/batch_obj_func to score swaps
+    upper_bounds: optional calculators.UpperBounds for players, used (with evaluator_func)
+                  to screen out swaps that can't improve the objective before scoring them
+
+    """
+    new_team = team.copy()
 
-    player_db = _opt_util.pre_process_database(players, constrained_players=constrained_players)
+    player_db = _opt_util.candidate_pools(players, constrained_players=constrained_players)
+
+    batch_obj_func, evaluator_func = _opt_util.objective_hooks(obj_func, batch_obj_func=batch_obj_func,
+                                                               evaluator_func=evaluator_func)
+    if evaluator_func is not None:
+        evaluator = evaluator_func(new_team)
+    else:
+        evaluator = None
 
     initial_obj = obj_func(new_team)
     if verbose:
@@ -22,7 +42,9 @@ def optimize(team, players, obj_func, constrained_players=None, candidate_roster
             current_obj = new_obj
 
         next_move = _best_step(new_team, player_db, obj_func, 
-                               candidate_roster_positions=candidate_roster_positions)
+                               candidate_roster_positions=candidate_roster_positions,
+                               batch_obj_func=batch_obj_func, evaluator=evaluator,
+                               upper_bounds=upper_bounds)
 
         if next_move is None:
             if verbose:
@@ -37,20 +59,35 @@ def optimize(team, players, obj_func, constrained_players=None, candidate_roster
                                                                   player_to_add, new_obj - current_obj, new_obj))
         
         new_team.set_position(position_to_replace, player_to_add)
+        if evaluator is not None:
+            evaluator.swap(position_to_replace, player_to_add)
+
         iters = iters + 1
 
+    if verbose and upper_bounds is not None:
+        print(upper_bounds)
+
     return new_team
 
 
-def _best_step(team, player_db, obj_func, candidate_roster_positions=None, verbose=False, debug=False):
+def _best_step(team, player_db, obj_func, candidate_roster_positions=None, batch_obj_func=None,
+               evaluator=None, upper_bounds=None, verbose=False, debug=False):
     """
     Find single best step to take
 
     candidate_roster_position is list of roster positions that we are allowed to change
+
+    batch_obj_func: optional function to score all swaps at a roster position in one call
+    evaluator: optional incremental evaluator for team, used to score swaps if given
+    upper_bounds: optional calculators.UpperBounds, only swaps whose bound beats the best
+                  objective so far are scored (needs evaluator)
     
     """
     
-    original_score  = obj_func(team)
+    if evaluator is not None:
+        original_score = evaluator.objective
+    else:
+        original_score = obj_func(team)
 
     if candidate_roster_positions is None:
         candidate_roster_positions = team.roster.keys()
@@ -62,25 +99,47 @@ def _best_step(team, player_db, obj_func, candidate_roster_positions=None, verbo
     if verbose:
         print("Original objective value: {}".format(original_score))
 
+    all_swap_players = []
     for roster_position in candidate_roster_positions:
         
-        cur_team = copy.deepcopy(team)
-
         possible_swaps = player_db[roster_position]
 
         if verbose:
             print("Checking swaps for {}: "
                   "{} potential players".format(roster_position, len(possible_swaps)))
 
+        swap_players = []
         for possible_swap_player in possible_swaps:
             if team.contains(possible_swap_player, exclude_position=roster_position):
                 if debug:
                     print("Skipping existing player: {}".format(possible_swap_player.display_name))
                 continue
 
-            cur_team.set_position(roster_position, possible_swap_player)
-            current_score = obj_func(cur_team)
+            swap_players.append(possible_swap_player)
+
+        all_swap_players.append((roster_position, swap_players))
+
+    # without screening, every swap at every roster position is scored in one pass
+    if evaluator is not None and upper_bounds is None:
+        all_swap_scores = evaluator.score_swaps_many(all_swap_players)
+    else:
+        all_swap_scores = [ None ] * len(all_swap_players)
+
+    for (roster_position, swap_players), swap_scores in zip(all_swap_players, all_swap_scores):
+        if evaluator is not None and upper_bounds is not None:
+            swap_bounds = evaluator.bound_swaps(roster_position, swap_players, upper_bounds)
+            swap_players = [ swap_players[i] for i in upper_bounds.screen(swap_bounds, best_score) ]
+            swap_scores = evaluator.score_swaps(roster_position, swap_players)
+        elif evaluator is None:
+            swap_teams = []
+            for possible_swap_player in swap_players:
+                cur_team = team.copy()
+                cur_team.set_position(roster_position, possible_swap_player)
+                swap_teams.append(cur_team)
+
+            swap_scores = _opt_util.evaluate_many(swap_teams, obj_func, batch_obj_func=batch_obj_func)
 
+        for possible_swap_player, current_score in zip(swap_players, swap_scores):
             if current_score > best_score:
                 if verbose:
                     print("Found new best objective value: "
@@ -1,4 +1,10 @@
-from ..team import _allowable_player_positions, _team_positions
+import multiprocessing
+import numpy as np
+from ..team import Team, _allowable_player_positions, _team_positions
+from ..cache import LRUCache
+from ..database import player_database
+from ..calculators import Standard, MultiStandard
+from ..store import create_store
 
 def pre_process_database(player_db, top_ovr_filter=50, include_boosted_players=True, constrained_players=None):
     """
@@ -12,34 +18,547 @@ def pre_process_database(player_db, top_ovr_filter=50, include_boosted_players=T
     creates dict of roster_positions -> list of eligble players based on
     _allowable_player_positions mapping
 
+    player_db can be a list of players or a database.PlayerDatabase (which is
+    built here otherwise)
+
     """
     
+    player_db = player_database(player_db)
     preprocessed_db = dict()
 
     for roster_position in _team_positions:
+        preprocessed_db[roster_position] = _candidate_players(player_db, roster_position, top_ovr_filter,
+                                                              include_boosted_players)
+
+    if constrained_players is not None:
+        for roster_position, possible_players_to_add in constrained_players.iteritems():
+            preprocessed_db[roster_position] = player_db.select(possible_players_to_add)
+
+    return preprocessed_db
+
+
+class CandidatePools(dict):
+    """
+    Preprocessed database (roster position -> list of eligible players, see
+    pre_process_database) that optimizers use as is when given it in place of
+    players
+
+    calculator:  calculator of score aware pools (see score_pre_process_database),
+                 or None
+    constrained_players: constraints the pools were made with
+    name_roster_positions: for score aware pools, dict of player name -> roster
+                 positions cards with that name can fill, over all players the
+                 pools were made from (see add_candidates)
+
+    """
+
+    def __init__(self, pools, calculator=None, constrained_players=None, name_roster_positions=None):
+        dict.__init__(self, pools)
+        self.calculator = calculator
+        self.constrained_players = constrained_players
+        self.name_roster_positions = name_roster_positions
+
+    def __repr__(self):
+        return "{}({} roster positions, {} candidates)".format(self.__class__.__name__, len(self),
+                                                               sum(len(pool) for pool in self.values()))
+
+
+def candidate_pools(players, top_ovr_filter=50, include_boosted_players=True, constrained_players=None,
+                    calculator=None):
+    """
+    CandidatePools for players (list of players or database.PlayerDatabase)
+
+    calculator: if given, pools are from score_pre_process_database instead (and
+                top_ovr_filter & include_boosted_players are ignored)
+
+    If players already is a CandidatePools it is returned as is (it already has
+    any constraints).  Pools aren't cached here, so callers running several
+    optimizers on the same players should make them once and pass them on in place
+    of players (as meta.optimize does).
+
+    """
+    if isinstance(players, CandidatePools):
+        return players
+
+    if calculator is not None:
+        players = player_database(players)
+        preprocessed_db = score_pre_process_database(players, calculator, constrained_players=constrained_players)
+        name_roster_positions = _name_roster_positions(players)
+    else:
+        preprocessed_db = pre_process_database(players, top_ovr_filter=top_ovr_filter,
+                                               include_boosted_players=include_boosted_players,
+                                               constrained_players=constrained_players)
+        name_roster_positions = None
+
+    return CandidatePools(preprocessed_db, calculator=calculator, constrained_players=constrained_players,
+                          name_roster_positions=name_roster_positions)
+
+
+def add_candidates(pools, players, new_players):
+    """
+    Score aware CandidatePools (see candidate_pools) for players, which are the
+    players pools were made from plus new_players
+
+    New players are inserted into the pools of roster positions they can fill, in
+    score order, so pools only grow and nothing left out was needed.  That's only
+    safe if none of new_players has boosts (they can change upper & lower bounds
+    and which teams get boosts) and none lets an existing name fill roster
+    positions it couldn't before (that can block dominators, see
+    score_pre_process_database), otherwise pools are made again from players.
+
+    """
+    calculator = pools.calculator
+    if calculator is None:
+        raise ValueError("Can only add candidates to score aware pools")
+
+    name_roster_positions = dict(pools.name_roster_positions)
+    for name, roster_positions in _name_roster_positions(new_players).items():
+        old_roster_positions = name_roster_positions.get(name)
+        if old_roster_positions is not None and not roster_positions <= old_roster_positions:
+            return candidate_pools(players, constrained_players=pools.constrained_players, calculator=calculator)
+
+        name_roster_positions[name] = roster_positions | (old_roster_positions or frozenset())
+
+    compiled_players = dict((id(player), calculator._compile_player(player)) for player in new_players)
+    if any(len(c.boosts) > 0 for c in compiled_players.values()):
+        return candidate_pools(players, constrained_players=pools.constrained_players, calculator=calculator)
+
+    constrained_positions = set(pools.constrained_players or [])
+    preprocessed_db = dict()
+    for roster_position, pool in pools.items():
         allowable_player_positions = _allowable_player_positions[roster_position]
-        possible_players_to_add = [ p for p in player_db if p.position in allowable_player_positions ]
+        added = [ player for player in new_players if player.position in allowable_player_positions ]
+        if roster_position in constrained_positions or len(added) == 0:
+            preprocessed_db[roster_position] = pool
+            continue
+
+        # same order as score_pre_process_database, new players come after old ones with equal scores
+        pool = pool + added
+        compiled_pool = [ calculator._compile_player(player) for player in pool ]
+        scores_raw, scores_rounded = calculator._position_scores(np.array([ c.position for c in compiled_pool ]),
+                                                                 np.array([ c.attributes for c in compiled_pool ]))
+        order = np.argsort(-scores_raw, kind='mergesort')
+        preprocessed_db[roster_position] = [ pool[i] for i in order ]
+
+    return CandidatePools(preprocessed_db, calculator=calculator, constrained_players=pools.constrained_players,
+                          name_roster_positions=name_roster_positions)
+
+
+def _name_roster_positions(players):
+    """
+    dict of player name -> frozenset of roster positions cards with that name can fill
+
+    """
+    position_roster_positions = dict()
+    name_roster_positions = dict()
+    for player in players:
+        roster_positions = position_roster_positions.get(player.position)
+        if roster_positions is None:
+            roster_positions = frozenset(roster_position for roster_position in _team_positions
+                                         if player.position in _allowable_player_positions[roster_position])
+            position_roster_positions[player.position] = roster_positions
 
-        if top_ovr_filter is not None:
+        name_roster_positions[player.name] = name_roster_positions.get(player.name, frozenset()) | roster_positions
 
-            # get list of boosted players now, before we filter
-            if include_boosted_players:
-                boosted_players = [ p for p in possible_players_to_add if len(p.boosts) > 0 ]
-            
-            # now filter
-            possible_players_to_add = sorted(possible_players_to_add, key=lambda x: x.adjusted_ovr, reverse=True)
-            possible_players_to_add = possible_players_to_add[:top_ovr_filter]
+    return name_roster_positions
 
-            # and add back boosted players if needed
-            if include_boosted_players:
-                boosted_players = [ p for p in boosted_players if p not in possible_players_to_add ]
-                possible_players_to_add.extend(boosted_players)
 
-        preprocessed_db[roster_position] = possible_players_to_add
+def score_pre_process_database(player_db, calculator, constrained_players=None):
+    """
+    Calculator aware version of pre_process_database: candidates for each roster
+    position are ranked by their (unboosted) position score under calculator
+    (calculators.Standard), and only players that can never be needed are dropped
+
+    A player with no boosts (on weighted attributes) is never needed if kept,
+    unboosted players of the same position dominate it -- ie, are always at least
+    as good at its roster position:
+      - they get the same boosts from any roster (same team, or neither team gets
+        team-specific boosts) and are at least as good on every weighted attribute
+        (no worse on negatively weighted ones), or
+      - their lower bound position score beats its upper bound (see
+        calculators.UpperBounds)
+    and one of them is always free to take its place.  A team can't have two cards
+    with the same name (see Team.contains), so that's when one dominator has the
+    player's own name, or some names of dominators outnumber the roster positions
+    any card with those names can fill (each other roster position blocks at most
+    one name).  Swapping in that dominator doesn't lower any position score, so for
+    objectives that never decrease when a position score increases (see
+    objectives.Objective.monotone) the best team is still made of candidates.
+
+    """
+    player_db = player_database(player_db)
+
+    compiled_players = [ calculator._compile_player(p) for p in player_db ]
+    boosted_teams = set(boost[0] for c in compiled_players for boost in c.boosts if boost[0] != 0)
+    bounds = calculator.upper_bounds(player_db)
+
+    # (name x roster position) table of roster positions any card with each name can fill
+    name_roster_positions = _name_roster_positions(player_db)
+    name_codes = dict((name, i) for i, name in enumerate(name_roster_positions))
+
+    name_slots = np.zeros((len(name_codes), len(_team_positions)), dtype=bool)
+    for name, roster_positions in name_roster_positions.items():
+        name_slots[name_codes[name], [ _team_positions.index(pos) for pos in roster_positions ]] = True
+
+    players_by_position = dict()
+    for player, compiled_player in zip(player_db, compiled_players):
+        players_by_position.setdefault(player.position, []).append((player, compiled_player))
+
+    # candidates (with scores) of each player position, shared by roster positions
+    candidates = dict()
+    for player_position, players in players_by_position.items():
+        num_roster_positions = len([ roster_position for roster_position in _team_positions
+                                     if player_position in _allowable_player_positions[roster_position] ])
+        if num_roster_positions > 0:
+            names = np.array([ name_codes[player.name] for player, c in players ], dtype=int)
+            candidates[player_position] = _undominated_players(players, calculator, bounds, boosted_teams,
+                                                               num_roster_positions, names, name_slots)
+
+    order = { id(player): i for i, player in enumerate(player_db) }
+
+    preprocessed_db = dict()
+    for roster_position in _team_positions:
+        scored_players = [ scored_player for player_position in _allowable_player_positions[roster_position]
+                           for scored_player in candidates.get(player_position, []) ]
+        scored_players = sorted(scored_players, key=lambda ps: (-ps[1], order[id(ps[0])]))
+        preprocessed_db[roster_position] = [ player for player, score in scored_players ]
 
     if constrained_players is not None:
-        for roster_position, possible_players_to_add in constrained_players.iteritems():
-            possible_players_to_add = [ p for p in player_db if p.display_name in possible_players_to_add ]
-            preprocessed_db[roster_position] = possible_players_to_add
+        for roster_position, possible_players_to_add in constrained_players.items():
+            preprocessed_db[roster_position] = player_db.select(possible_players_to_add)
 
     return preprocessed_db
+
+
+def _undominated_players(players, calculator, bounds, boosted_teams, num_roster_positions, names, name_slots):
+    """
+    List of (player, raw position score) for (player, compiled player) pairs of one
+    player position that aren't dominated by others that are free to take their
+    place (see score_pre_process_database)
+
+    names are the players' name codes, indexing rows of name_slots (name x roster
+    position table of roster positions cards with each name can fill)
+
+    """
+    compiled_players = [ c for player, c in players ]
+    position = compiled_players[0].position
+
+    raw = np.array([ c.attributes for c in compiled_players ]).reshape(len(players), -1)
+    scores_raw, scores_rounded = calculator._position_scores(np.full(len(players), position, dtype=int), raw)
+
+    weights = calculator._weight_matrix[position]
+    columns = np.flatnonzero(weights)
+    signed = raw[:, columns] * np.sign(weights[columns])
+
+    # players getting the same boosts from any roster are in the same group
+    team_codes = np.array([ c.team for c in compiled_players ], dtype=int)
+    groups = np.where(np.in1d(team_codes, list(boosted_teams)), team_codes, -1)
+
+    lower_bounds = np.array([ bounds.lower(player)[0] for player, c in players ])
+    upper_bounds = np.array([ bounds.get(player)[0] for player, c in players ])
+
+    unboosted = np.array([ len(c.boosts) == 0 for c in compiled_players ], dtype=bool)
+    keep = np.ones(len(players), dtype=bool)
+
+    # best first, so players mostly come after those that dominate them
+    order = np.flatnonzero(unboosted)
+    order = order[np.lexsort([ order ] + [ -signed[order, j] for j in reversed(range(len(columns))) ] +
+                             [ -lower_bounds[order] ])]
+
+    kept = np.zeros(len(order), dtype=int)
+    num_kept = 0
+    for iplayer in order:
+        if num_kept >= num_roster_positions:
+            candidates = kept[:num_kept]
+            dominating = ((lower_bounds[candidates] >= upper_bounds[iplayer]) |
+                          ((groups[candidates] == groups[iplayer]) &
+                           np.all(signed[candidates] >= signed[iplayer], axis=1)))
+
+            if _free_dominator(names[candidates[dominating]], names[iplayer], name_slots, num_roster_positions):
+                keep[iplayer] = False
+                continue
+
+        kept[num_kept] = iplayer
+        num_kept += 1
+
+    return [ (player, score) for (player, c), score, kept in zip(players, scores_raw.tolist(), keep) if kept ]
+
+
+def _free_dominator(dominator_names, name, name_slots, num_roster_positions):
+    """
+    True if one of the dominators (by name code) of a player with name is free to
+    take its place on any team
+
+    """
+    dominator_names = np.unique(dominator_names)
+    if len(dominator_names) < num_roster_positions:
+        # every dominator's name can fill all num_roster_positions
+        return name in dominator_names
+
+    if name in dominator_names:
+        return True
+
+    # names that can fill the fewest roster positions first; other roster positions
+    # can't block all of the first k names if k beats the roster positions they fill
+    dominator_slots = name_slots[dominator_names]
+    dominator_slots = dominator_slots[np.argsort(dominator_slots.sum(axis=1), kind='mergesort')]
+    num_slots = np.logical_or.accumulate(dominator_slots, axis=0).sum(axis=1)
+
+    return bool(np.any(np.arange(1, len(dominator_names) + 1) >= num_slots))
+
+
+def refresh_preprocessed_database(preprocessed_db, player_db, diff, top_ovr_filter=50, include_boosted_players=True,
+                                  constrained_players=None):
+    """
+    pre_process_database for updated player_db, redoing only roster positions that
+    cards in diff (database.DatabaseDiff from the database preprocessed_db came
+    from) are eligible for
+
+    Other roster positions keep their lists (of equal players from the old database)
+
+    Score aware CandidatePools (see candidate_pools) are made again from player_db
+    instead, since their pruning depends on every player (bounds, boosts & names
+    across roster positions), so a changed card can change any pool.  CandidatePools
+    get back CandidatePools.
+
+    """
+    if isinstance(preprocessed_db, CandidatePools):
+        if constrained_players is None:
+            constrained_players = preprocessed_db.constrained_players
+
+        if preprocessed_db.calculator is not None:
+            return candidate_pools(player_db, constrained_players=constrained_players,
+                                   calculator=preprocessed_db.calculator)
+
+    player_db = player_database(player_db)
+    affected_positions = diff.positions
+
+    refreshed_db = dict()
+    for roster_position in _team_positions:
+        if affected_positions.isdisjoint(_allowable_player_positions[roster_position]):
+            refreshed_db[roster_position] = preprocessed_db[roster_position]
+        else:
+            refreshed_db[roster_position] = _candidate_players(player_db, roster_position, top_ovr_filter,
+                                                               include_boosted_players)
+
+    if constrained_players is not None:
+        for roster_position, possible_players_to_add in constrained_players.items():
+            refreshed_db[roster_position] = player_db.select(possible_players_to_add)
+
+    if isinstance(preprocessed_db, CandidatePools):
+        refreshed_db = CandidatePools(refreshed_db, constrained_players=constrained_players)
+
+    return refreshed_db
+
+
+def _candidate_players(player_db, roster_position, top_ovr_filter, include_boosted_players):
+    """
+    Players of PlayerDatabase eligible for roster_position (see pre_process_database)
+
+    """
+    allowable_player_positions = _allowable_player_positions[roster_position]
+    possible_players_to_add = player_db.query(positions=allowable_player_positions)
+
+    if top_ovr_filter is not None:
+
+        # get list of boosted players now, before we filter
+        if include_boosted_players:
+            boosted_players = [ p for p in possible_players_to_add if len(p.boosts) > 0 ]
+        
+        # now filter
+        possible_players_to_add = sorted(possible_players_to_add, key=lambda x: x.adjusted_ovr, reverse=True)
+        possible_players_to_add = possible_players_to_add[:top_ovr_filter]
+
+        # and add back boosted players if needed
+        if include_boosted_players:
+            top_players = set(id(p) for p in possible_players_to_add)
+            boosted_players = [ p for p in boosted_players if id(p) not in top_players ]
+            possible_players_to_add.extend(boosted_players)
+
+    return possible_players_to_add
+
+
+def pool_calculator(obj_func):
+    """
+    Calculator for score aware candidate pools of obj_func (see candidate_pools),
+    or None if it isn't an objective those are safe for (monotone
+    objectives.Objective of a calculators.Standard)
+
+    """
+    if isinstance(obj_func, CachedObjective):
+        obj_func = obj_func.obj_func
+
+    calculator = getattr(obj_func, 'calculator', None)
+
+    if not getattr(obj_func, 'monotone', False) or not isinstance(calculator, Standard):
+        return None
+
+    if isinstance(calculator, MultiStandard):
+        return None
+
+    return calculator
+
+
+def evaluate_many(teams, obj_func, batch_obj_func=None):
+    """
+    Objective values for list of teams
+
+    batch_obj_func: optional function that scores a whole list of teams in one
+                    call (eg, using Standard.calculate_many).  If None, each team is
+                    scored with obj_func
+
+    """
+    if len(teams) == 0:
+        obj_values = []
+    elif batch_obj_func is not None:
+        obj_values = list(batch_obj_func(teams))
+    else:
+        obj_values = [ obj_func(team) for team in teams ]
+
+    return obj_values
+
+
+def objective_hooks(obj_func, batch_obj_func=None, evaluator_func=None):
+    """
+    batch_obj_func & evaluator_func to use for obj_func
+
+    If obj_func is an objective spec (see mobile_companion.objectives.Objective),
+    any hooks not given are taken from it, otherwise they are left as given
+
+    """
+    if batch_obj_func is None:
+        batch_obj_func = getattr(obj_func, 'batch_obj_func', None)
+
+    if evaluator_func is None:
+        evaluator_func = getattr(obj_func, 'evaluator_func', None)
+
+    return batch_obj_func, evaluator_func
+
+
+class CachedObjective(object):
+    """
+    obj_func memoized by roster (Team.key), for sharing between optimizers
+
+    Each cached value keeps the roster's players, so their ids (and so the key)
+    can't be reused by other players while it's cached.
+
+    Called with a team like obj_func, and batch_obj_func only scores teams that
+    aren't cached (with the given batch_obj_func if any).  Any evaluator_func of
+    obj_func is passed through, since incremental evaluation isn't cached.  See
+    cache for hit rates.
+
+    """
+
+    def __init__(self, obj_func, batch_obj_func=None, evaluator_func=None, maxsize=100000):
+        self.obj_func = obj_func
+        self._batch_obj_func, self.evaluator_func = objective_hooks(obj_func, batch_obj_func=batch_obj_func,
+                                                                    evaluator_func=evaluator_func)
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def __call__(self, team):
+        key = team.key
+
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = (self.obj_func(team), tuple(team.roster.values()))
+            self.cache.set(key, cached)
+
+        return cached[0]
+
+    def batch_obj_func(self, teams):
+        keys = [ team.key for team in teams ]
+        obj_values = [ cached if cached is None else cached[0] for cached in self.cache.get_many(keys) ]
+
+        missing = [ i for i, obj_value in enumerate(obj_values) if obj_value is None ]
+        missing_values = evaluate_many([ teams[i] for i in missing ], self.obj_func,
+                                       batch_obj_func=self._batch_obj_func)
+
+        for i, obj_value in zip(missing, missing_values):
+            obj_values[i] = obj_value
+            self.cache.set(keys[i], (obj_value, tuple(teams[i].roster.values())))
+
+        return obj_values
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.cache)
+
+
+class ObjectivePool(object):
+    """
+    Persistent pool of worker processes scoring lists of teams made of players
+
+    Each worker gets obj_func & batch_obj_func once when it starts (so on
+    platforms that spawn rather than fork workers, they must be picklable), and
+    attaches to a shared store of players (see store.create_store), so workers
+    share one copy of them.  Teams are sent to workers as player indices.
+    batch_obj_func scores a list of teams by splitting it between workers, giving
+    the same values in the same order as scoring it in this process.  close() when
+    done (or use as a context manager), which also unlinks the store.
+
+    players: players teams are made of (eg all players in candidate pools)
+
+    """
+
+    def __init__(self, obj_func, players, processes, batch_obj_func=None):
+        self.processes = processes
+        self._player_index = dict((id(player), iplayer) for iplayer, player in enumerate(players))
+
+        batch_obj_func = objective_hooks(obj_func, batch_obj_func=batch_obj_func)[0]
+        self._store = create_store(list(players))
+        try:
+            self._pool = multiprocessing.Pool(processes, initializer=_init_objective_worker,
+                                              initargs=(obj_func, batch_obj_func, self._store))
+        except Exception:
+            self._store.unlink()
+            raise
+
+    def batch_obj_func(self, teams):
+        rosters = [ [ self._player_index[id(player)] for player in team.roster.values() ] for team in teams ]
+
+        chunk_size = -(-len(rosters) // self.processes)
+        chunks = [ rosters[i:i + chunk_size] for i in range(0, len(rosters), chunk_size) ]
+
+        return [ obj_value for chunk_values in self._pool.map(_evaluate_rosters, chunks)
+                 for obj_value in chunk_values ]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._store.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return "{}({} processes, {} players)".format(self.__class__.__name__, self.processes,
+                                                     len(self._player_index))
+
+
+# (obj_func, batch_obj_func, players) of an ObjectivePool worker
+_objective_worker = None
+
+def _init_objective_worker(obj_func, batch_obj_func, player_store):
+    global _objective_worker
+    _objective_worker = (obj_func, batch_obj_func, player_store.players())
+
+
+def _evaluate_rosters(rosters):
+    """
+    Objective values of rosters (lists of player indices, in _team_positions order)
+    in an ObjectivePool worker
+
+    """
+    obj_func, batch_obj_func, players = _objective_worker
+
+    teams = []
+    for roster in rosters:
+        team = Team()
+        for roster_position, iplayer in zip(_team_positions, roster):
+            team.set_position(roster_position, players[iplayer])
+
+        teams.append(team)
+
+    return evaluate_many(teams, obj_func, batch_obj_func=batch_obj_func)
@@ -0,0 +1,277 @@
+"""
+Genetic optimizer over a whole population at once
+
+The population is a 2-D array of player indices (individual x roster position, in
+_team_positions order), so selection, crossover, mutation and repair of rosters
+with the same player twice are array operations, and fitness comes from one
+batched calculation (calculators.Standard.calculate_rosters).  Much larger
+populations than genetic.optimize are practical in the same time.
+
+"""
+from ..team import Team, _team_positions
+import util as _opt_util
+import numpy as np
+
+def optimize(population_size, players, obj_func, num_evolutions=100, include_individuals=None,
+             constrained_players=None, keep_top_pct=.2, mutation_probability=.5, mutation_rate=.1,
+             tournament_size=2, seed=None, verbose=False):
+    """
+    Vectorized genetic optimization
+
+    obj_func: objectives.Objective (its calculator & score_func are used to score
+              the population in one pass)
+    include_individuals: optional list of teams to include in initial population
+    keep_top_pct: fraction of population kept as is each evolution, the rest are
+                  children of parents picked by tournaments of tournament_size
+    mutation_probability, mutation_rate: probability of mutating a child, and of
+                  each of its roster positions getting a random player if it is
+    seed: seed (or numpy RandomState) for reproducible results
+
+    Returns (best team, misc results) like genetic.optimize, with the final
+    population in misc results as a Population
+
+    """
+    if isinstance(obj_func, _opt_util.CachedObjective):
+        obj_func = obj_func.obj_func
+
+    if not hasattr(obj_func, 'calculator') or not hasattr(obj_func, 'score_func'):
+        raise ValueError("Vectorized genetic optimization needs an objectives.Objective")
+
+    if isinstance(seed, np.random.RandomState):
+        random_state = seed
+    else:
+        random_state = np.random.RandomState(seed)
+
+    preprocessed_player_db = _opt_util.candidate_pools(players, constrained_players=constrained_players,
+                                                       calculator=_opt_util.pool_calculator(obj_func))
+    population = Population(preprocessed_player_db, obj_func, include_individuals=include_individuals)
+
+    rosters = population.random_rosters(population_size - len(population.include_rosters), random_state)
+    rosters = np.concatenate([ population.include_rosters, rosters ])[:population_size]
+    obj_values = population.evaluate(rosters)
+
+    if verbose:
+        print("initial population: mean={:.2f}, max={:.2f}".format(_mean(obj_values), obj_values.max()))
+
+    for istep in range(num_evolutions):
+        rosters, obj_values = population.evolve(rosters, obj_values, random_state, keep_top_pct=keep_top_pct,
+                                                mutation_probability=mutation_probability,
+                                                mutation_rate=mutation_rate, tournament_size=tournament_size)
+
+        if verbose:
+            print("iteration[{}]: population: mean={:.2f}, max={:.2f}".format(istep, _mean(obj_values),
+                                                                              obj_values.max()))
+
+    population.rosters = rosters
+    population.obj_values = obj_values
+
+    if not np.isfinite(obj_values).any():
+        raise ValueError("No valid roster found (every roster has a player twice), there may be too few "
+                         "candidates with different names")
+
+    best_res = population.team(rosters[np.argmax(obj_values)])
+
+    misc_res = dict()
+    misc_res['population'] = population
+
+    return best_res, misc_res
+
+
+class Population(object):
+    """
+    Candidate players of each roster position as arrays, and operations on
+    populations of rosters (individual x roster position array of indices into
+    players, in _team_positions order)
+
+    players:    unique candidate players
+    rosters, obj_values: final population & objective values (set by optimize)
+
+    Rosters with the same player (by name) twice that can't be repaired score -inf.
+    Raises ValueError if any roster position has no candidates.
+
+    """
+
+    def __init__(self, preprocessed_player_db, obj_func, include_individuals=None):
+        self.obj_func = obj_func
+        self.calculator = obj_func.calculator
+
+        players = []
+        player_index = dict()
+
+        def index(player):
+            iplayer = player_index.get(id(player))
+            if iplayer is None:
+                iplayer = len(players)
+                players.append(player)
+                player_index[id(player)] = iplayer
+
+            return iplayer
+
+        candidates = [ [ index(p) for p in preprocessed_player_db[roster_position] ]
+                       for roster_position in _team_positions ]
+
+        empty = [ roster_position for roster_position, c in zip(_team_positions, candidates) if len(c) == 0 ]
+        if len(empty) > 0:
+            raise ValueError("No candidates for roster positions: {}".format(", ".join(empty)))
+
+        if include_individuals is None:
+            include_individuals = []
+
+        self.include_rosters = np.array([ [ index(team.roster[roster_position]) for roster_position in _team_positions ]
+                                         for team in include_individuals ], dtype=int).reshape(-1, len(_team_positions))
+
+        self.players = players
+        self.compiled_players = self.calculator.compile_players(players)
+
+        # (roster position x candidate) table padded with each roster position's first candidate
+        self.num_candidates = np.array([ len(c) for c in candidates ], dtype=int)
+        self.candidates = np.array([ c + c[:1] * (self.num_candidates.max() - len(c)) for c in candidates ], dtype=int)
+
+        names = dict()
+        self.name_codes = np.array([ names.setdefault(p.name, len(names)) for p in players ], dtype=int)
+
+        self.rosters = None
+        self.obj_values = None
+
+    def __len__(self):
+        return 0 if self.rosters is None else len(self.rosters)
+
+    def random_players(self, roster_slots, random_state):
+        """
+        Random candidate for each of roster_slots (array of roster position indices)
+
+        """
+        choices = (random_state.random_sample(roster_slots.shape) * self.num_candidates[roster_slots]).astype(int)
+        return self.candidates[roster_slots, choices]
+
+    def random_rosters(self, num_rosters, random_state):
+        """
+        num_rosters random (repaired) rosters
+
+        """
+        roster_slots = np.broadcast_to(np.arange(len(_team_positions)), (max(num_rosters, 0), len(_team_positions)))
+        rosters = self.random_players(roster_slots, random_state)
+        self.repair(rosters, random_state)
+
+        return rosters
+
+    def duplicates(self, rosters):
+        """
+        bool array (same shape as rosters) of roster slots holding a player (by name)
+        that is also in an earlier slot, where slots with fewer candidates come first
+        (so constrained roster positions keep their player)
+
+        """
+        name_codes = self.name_codes[rosters]
+        order = np.lexsort((np.broadcast_to(self.num_candidates, rosters.shape), name_codes), axis=1)
+        sorted_codes = np.take_along_axis(name_codes, order, axis=1)
+
+        duplicates = np.zeros(rosters.shape, dtype=bool)
+        rows = np.arange(len(rosters))[:, None]
+        duplicates[rows, order[:, 1:]] = sorted_codes[:, 1:] == sorted_codes[:, :-1]
+
+        return duplicates
+
+    def repair(self, rosters, random_state, max_tries=10):
+        """
+        Give duplicated players (see duplicates) new random candidates in place
+
+        Returns bool array of rosters still holding a duplicate after max_tries
+
+        """
+        for itry in range(max_tries):
+            rows, roster_slots = np.nonzero(self.duplicates(rosters))
+            if len(rows) == 0:
+                break
+
+            rosters[rows, roster_slots] = self.random_players(roster_slots, random_state)
+
+        return self.duplicates(rosters).any(axis=1)
+
+    def evaluate(self, rosters, invalid=None):
+        """
+        Objective values of rosters (-inf where invalid)
+
+        """
+        obj_values = np.asarray(self.obj_func.score_func(self.calculator.calculate_rosters(self.compiled_players,
+                                                                                           rosters)), dtype=float)
+        if invalid is None:
+            invalid = self.duplicates(rosters).any(axis=1)
+
+        obj_values[invalid] = -np.inf
+
+        return obj_values
+
+    def evolve(self, rosters, obj_values, random_state, keep_top_pct=.2, mutation_probability=.5,
+               mutation_rate=.1, tournament_size=2):
+        """
+        Evolve population one step
+
+        Returns new rosters & their objective values
+
+        """
+        num_rosters = len(rosters)
+        keep_top_count = int(num_rosters * keep_top_pct)
+        child_count = num_rosters - keep_top_count
+
+        # keep top individuals
+        top = np.argsort(-obj_values, kind='mergesort')[:keep_top_count]
+
+        # parents are tournament winners, children take each player from either parent
+        mothers = self.tournament(obj_values, child_count, tournament_size, random_state)
+        fathers = self.tournament(obj_values, child_count, tournament_size, random_state)
+
+        crossover = random_state.random_sample((child_count, rosters.shape[1])) < .5
+        children = np.where(crossover, rosters[mothers], rosters[fathers])
+
+        # mutate some
+        mutate = ((random_state.random_sample((child_count, 1)) < mutation_probability) &
+                  (random_state.random_sample(children.shape) < mutation_rate))
+        rows, roster_slots = np.nonzero(mutate)
+        children[rows, roster_slots] = self.random_players(roster_slots, random_state)
+
+        invalid = self.repair(children, random_state)
+
+        new_rosters = np.concatenate([ rosters[top], children ])
+        new_obj_values = np.concatenate([ obj_values[top], self.evaluate(children, invalid=invalid) ])
+
+        return new_rosters, new_obj_values
+
+    @staticmethod
+    def tournament(obj_values, num_winners, tournament_size, random_state):
+        """
+        Indices of winners of num_winners tournaments between random individuals
+
+        """
+        entrants = random_state.randint(len(obj_values), size=(num_winners, tournament_size))
+        winners = np.argmax(obj_values[entrants], axis=1)
+
+        return entrants[np.arange(num_winners), winners]
+
+    def team(self, roster):
+        """
+        Team from roster (array of indices into players)
+
+        """
+        team = Team()
+        for roster_position, iplayer in zip(_team_positions, roster):
+            team.set_position(roster_position, self.players[iplayer])
+
+        return team
+
+    def teams(self, rosters=None):
+        """
+        Teams from rosters (default is the final population)
+
+        """
+        if rosters is None:
+            rosters = self.rosters
+
+        return [ self.team(roster) for roster in rosters ]
+
+    def __repr__(self):
+        return "{}({} individuals, {} candidates)".format(self.__class__.__name__, len(self), len(self.players))
+
+
+def _mean(values):
+    return float(np.mean(values[np.isfinite(values)]))